@@ -1,12 +1,67 @@
 from telegram import Update, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
-from config import TELEGRAM_BOT_TOKEN
-from storage import init_db, add_expense, get_today_total, get_month_total, convert_currency, get_user_settings, set_display_currency, set_exchange_rate
-from openai_client import transcribe_audio, extract_text_from_image, parse_expense_from_text
-from expense_parser import extract_expense, extract_expense_with_category
-import base64
-import io
+from config import (
+    TELEGRAM_BOT_TOKEN,
+    CONCURRENT_UPDATES,
+    IMPORT_REQUEST_DEADLINE,
+    IMPORT_PROGRESS_INTERVAL,
+    MEDIA_MAX_BYTES,
+    MEDIA_SPOOL_MEMORY_BYTES,
+    EXPORT_MAX_UPLOAD_BYTES,
+    BOT_MODE,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_URL,
+    WEBHOOK_SECRET_TOKEN,
+    WEBHOOK_MAX_CONNECTIONS,
+    TELEGRAM_API_BASE_URL,
+    BOT_WORKERS,
+)
+from storage import (
+    init_db,
+    get_today_total,
+    get_month_total,
+    get_expenses_by_periods,
+    get_daily_series,
+    month_bounds,
+    get_conversion_context,
+    get_user_settings,
+    set_display_currency,
+    set_exchange_rate,
+    ConversionContext,
+)
+from db import close_pool
+from exchange_rates import get_rates_status, start_rate_refresher, stop_rate_refresher
+from executors import run_db, run_api, shutdown_executors
+from openai_scheduler import begin_request
+from media import download_media, close_media_client, MediaTooLargeError, MediaDownloadError
+from image_preprocessing import choose_photo_size, prepare_image_for_ocr
+from openai_client import extract_text_from_image
+from transcription import transcribe, close_backend
+from expense_parser import extract_expenses, find_currency
+from importer import import_expenses_csv, CsvImportError
+from exporter import export_expenses, ExportFormatError, EXPORT_FORMATS
+from charts import render_chart, close_chart_renderer
+from pending_expenses import create_pending, confirm_pending, discard_pending, stop_confirmation_batcher
+from sharding import UserOrderedUpdateProcessor, run_sharded
+from stats import start_stats_logger, stop_stats_logger
+from jobs import (
+    enqueue_job,
+    attach_reply,
+    job_reply,
+    register_job_handler,
+    start_job_runner,
+    stop_job_runner,
+    wake_job_runner,
+    PermanentJobError,
+)
+from dataclasses import asdict
+from datetime import date, datetime, timedelta
+import asyncio
 import logging
+import tempfile
+import time
 
 def get_currency_name(currency: str) -> str:
     currency_map = {
@@ -38,13 +93,38 @@ def format_amount(amount: float) -> str:
         return f"{integer_part}.{parts[1]}"
     return integer_part
 
+def get_rates_status_text() -> str:
+    status = get_rates_status()
+    if status['fetched_at'] is None:
+        return "Рыночные курсы еще не получены, используются резервные."
+    
+    updated = status['fetched_at'].astimezone().strftime('%d.%m.%Y %H:%M')
+    text = f"Рыночные курсы обновлены: {updated}"
+    if status['is_stale']:
+        text += " (устарели)"
+    return text
+
+class RedactTokenFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage().replace(TELEGRAM_BOT_TOKEN, '<TOKEN>')
+        record.args = None
+        if record.exc_text:
+            record.exc_text = record.exc_text.replace(TELEGRAM_BOT_TOKEN, '<TOKEN>')
+        return True
+
+log_handlers = [
+    logging.FileHandler('bot.log', encoding='utf-8'),
+    logging.StreamHandler()
+]
+for log_handler in log_handlers:
+    log_handler.addFilter(RedactTokenFilter())
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
+    handlers=log_handlers
 )
 
 logging.getLogger('telegram').setLevel(logging.WARNING)
@@ -54,6 +134,8 @@ logging.getLogger('urllib3').setLevel(logging.WARNING)
 
 logger = logging.getLogger(__name__)
 
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     username = update.effective_user.username
@@ -74,9 +156,12 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "Команды:\n"
         "/today - показать сумму расходов за сегодня\n"
-        "/month - показать сумму расходов за текущий месяц\n"
+        "/month - показать сумму расходов за текущий месяц (/month chart - с графиком)\n"
+        "/report - отчет за неделю, произвольный период, с начала года или сравнение с прошлым месяцем\n"
         "/settings - настройки валюты отображения\n"
         "/setrate - установить курс валюты\n"
+        "/import - импорт расходов из CSV-выписки\n"
+        "/export - выгрузить расходы в CSV или Parquet\n"
         "/help - эта справка\n\n"
         "Также можно просто отправлять сообщения с расходами:\n"
         "- Текстовое сообщение\n"
@@ -84,6 +169,52 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "- Фото чека или скриншота"
     )
 
+def describe_expense(expense: dict, ctx: ConversionContext) -> str:
+    amount = expense['amount']
+    currency = expense['currency']
+    category = expense['category']
+    currency_name = get_currency_name(currency)
+    
+    if currency == ctx.display_currency:
+        return f"{amount:.2f} {currency_name} в категории {category}"
+    converted_amount = ctx.convert(amount, currency)
+    return f"{amount:.2f} {currency_name} ({converted_amount:.2f} {get_currency_name(ctx.display_currency)}) в категории {category}"
+
+def describe_expenses(expenses: list[dict], ctx: ConversionContext) -> list[str]:
+    lines = [f"{i}. {describe_expense(expense, ctx)}" for i, expense in enumerate(expenses, 1)]
+    total = sum(ctx.convert(expense['amount'], expense['currency']) for expense in expenses)
+    lines.append(f"Итого: {total:.2f} {get_currency_name(ctx.display_currency)}")
+    return lines
+
+async def build_expense_proposal(user_id: int, expenses: list, source_type: str, prefix: str = "",
+                                 cached_settings: bool = True, **source_data) -> tuple[str, InlineKeyboardMarkup]:
+    expenses = [asdict(expense) for expense in expenses]
+    ctx = await run_db(get_conversion_context, user_id, cached_settings)
+    
+    if len(expenses) == 1:
+        preview_text = f"{prefix}Расход {describe_expense(expenses[0], ctx)}"
+        question = "Подтвердите сохранение расхода:"
+        confirm_label = "Подтвердить"
+    else:
+        preview_text = prefix + "\n".join([f"Расходы ({len(expenses)}):"] + describe_expenses(expenses, ctx))
+        question = "Подтвердите сохранение расходов:"
+        confirm_label = f"Подтвердить все ({len(expenses)})"
+    
+    pending_id = await run_db(create_pending, user_id, expenses, source_type, source_data)
+    
+    keyboard = [
+        [
+            InlineKeyboardButton(confirm_label, callback_data=f"confirm_expense:{pending_id}"),
+            InlineKeyboardButton("Отменить", callback_data=f"cancel_expense:{pending_id}")
+        ]
+    ]
+    return f"{preview_text}\n\n{question}", InlineKeyboardMarkup(keyboard)
+
+async def propose_expenses(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, expenses: list,
+                           source_type: str, prefix: str = "", **source_data):
+    text, reply_markup = await build_expense_proposal(user_id, expenses, source_type, prefix, **source_data)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
     user_id = update.effective_user.id
@@ -92,41 +223,13 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     logger.info(f"Получено текстовое сообщение от пользователя {user_id}: {text[:100]}")
+    begin_request(user_id)
     
     try:
-        amount, currency, category = extract_expense_with_category(text)
+        expenses = await run_api(extract_expenses, text)
         
-        if amount > 0:
-            currency_name = get_currency_name(currency)
-            settings = get_user_settings(user_id)
-            display_currency = settings['display_currency']
-            display_currency_name = get_currency_name(display_currency)
-            
-            if currency == display_currency:
-                preview_text = f"Расход {amount:.2f} {currency_name} в категории {category}"
-            else:
-                converted_amount = convert_currency(amount, currency, user_id)
-                preview_text = f"Расход {amount:.2f} {currency_name} ({converted_amount:.2f} {display_currency_name}) в категории {category}"
-            
-            context.user_data['pending_expense'] = {
-                'amount': amount,
-                'currency': currency,
-                'category': category,
-                'source_type': 'text'
-            }
-            
-            keyboard = [
-                [
-                    InlineKeyboardButton("Подтвердить", callback_data="confirm_expense"),
-                    InlineKeyboardButton("Отменить", callback_data="cancel_expense")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
-                f"{preview_text}\n\nПодтвердите сохранение расхода:",
-                reply_markup=reply_markup
-            )
+        if expenses:
+            await propose_expenses(update, context, user_id, expenses, 'text')
         else:
             logger.warning(f"Не удалось извлечь сумму из сообщения пользователя {user_id}: {text[:100]}")
             await update.message.reply_text(
@@ -136,183 +239,350 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Ошибка при обработке текстового сообщения от пользователя {user_id}: {str(e)}", exc_info=True)
         await update.message.reply_text(f"Ошибка при обработке сообщения: {str(e)}")
 
+async def enqueue_media(update: Update, user_id: int, kind: str, payload: dict, ack_text: str):
+    message = update.message
+    job_id = await run_db(enqueue_job, kind, user_id, message.chat_id, message.message_id, payload)
+    if job_id is None:
+        return
+    status_message = await message.reply_text(ack_text)
+    await run_db(attach_reply, job_id, status_message.message_id)
+    wake_job_runner()
+
 async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     logger.info(f"Получено голосовое сообщение от пользователя {user_id}")
     
-    voice_file = await context.bot.get_file(update.message.voice.file_id)
-    audio_bytes = await voice_file.download_as_bytearray()
-    audio_stream = io.BytesIO(audio_bytes)
-    audio_stream.name = "voice.ogg"
+    voice = update.message.voice
+    if voice.file_size and voice.file_size > MEDIA_MAX_BYTES:
+        logger.warning(f"Голосовое сообщение от пользователя {user_id} слишком большое: {voice.file_size} байт")
+        await update.message.reply_text("Голосовое сообщение слишком большое.")
+        return
     
-    try:
-        transcribed_text = transcribe_audio(audio_stream)
-        logger.info(f"Транскрипция голосового сообщения от пользователя {user_id}: {transcribed_text[:100]}")
-        amount, currency, category = extract_expense_with_category(transcribed_text)
-        
-        if amount > 0:
-            currency_name = get_currency_name(currency)
-            settings = get_user_settings(user_id)
-            display_currency = settings['display_currency']
-            display_currency_name = get_currency_name(display_currency)
-            
-            if currency == display_currency:
-                preview_text = f"Распознано: {transcribed_text}\nРасход {amount:.2f} {currency_name} в категории {category}"
-            else:
-                converted_amount = convert_currency(amount, currency, user_id)
-                preview_text = f"Распознано: {transcribed_text}\nРасход {amount:.2f} {currency_name} ({converted_amount:.2f} {display_currency_name}) в категории {category}"
-            
-            context.user_data['pending_expense'] = {
-                'amount': amount,
-                'currency': currency,
-                'category': category,
-                'source_type': 'voice',
-                'transcribed_text': transcribed_text
-            }
-            
-            keyboard = [
-                [
-                    InlineKeyboardButton("Подтвердить", callback_data="confirm_expense"),
-                    InlineKeyboardButton("Отменить", callback_data="cancel_expense")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
-                f"{preview_text}\n\nПодтвердите сохранение расхода:",
-                reply_markup=reply_markup
-            )
-        else:
-            logger.warning(f"Не удалось извлечь сумму из транскрипции пользователя {user_id}: {transcribed_text[:100]}")
-            await update.message.reply_text(
-                f"Распознано: {transcribed_text}\n"
-                "Не удалось извлечь сумму расхода."
-            )
-    except Exception as e:
-        logger.error(f"Ошибка при обработке голосового сообщения от пользователя {user_id}: {str(e)}", exc_info=True)
-        await update.message.reply_text(f"Ошибка при обработке голосового сообщения: {str(e)}")
+    await enqueue_media(
+        update, user_id, 'voice',
+        {'file_id': voice.file_id, 'file_size': voice.file_size, 'duration': voice.duration},
+        "Голосовое сообщение принято, распознаю..."
+    )
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     logger.info(f"Получено фото от пользователя {user_id}")
     
-    photo = update.message.photo[-1]
-    photo_file = await context.bot.get_file(photo.file_id)
-    image_bytes = await photo_file.download_as_bytearray()
+    photo = choose_photo_size(update.message.photo)
+    if photo.file_size and photo.file_size > MEDIA_MAX_BYTES:
+        logger.warning(f"Фото от пользователя {user_id} слишком большое: {photo.file_size} байт")
+        await update.message.reply_text("Изображение слишком большое.")
+        return
+    
+    await enqueue_media(
+        update, user_id, 'photo',
+        {'file_id': photo.file_id, 'file_size': photo.file_size},
+        "Фото принято, читаю текст..."
+    )
+
+async def process_voice_job(bot, job: dict):
+    user_id = job['user_id']
+    payload = job['payload']
+    begin_request(user_id)
     
     try:
-        image_base64 = base64.b64encode(bytes(image_bytes)).decode('utf-8')
-        extracted_text = extract_text_from_image(image_base64)
-        logger.info(f"Текст из изображения от пользователя {user_id}: {extracted_text[:100]}")
-        amount, currency, category = extract_expense_with_category(extracted_text)
-        
-        if amount > 0:
-            currency_name = get_currency_name(currency)
-            settings = get_user_settings(user_id)
-            display_currency = settings['display_currency']
-            display_currency_name = get_currency_name(display_currency)
-            
-            if currency == display_currency:
-                preview_text = f"Прочитано с изображения: {extracted_text}\nРасход {amount:.2f} {currency_name} в категории {category}"
-            else:
-                converted_amount = convert_currency(amount, currency, user_id)
-                preview_text = f"Прочитано с изображения: {extracted_text}\nРасход {amount:.2f} {currency_name} ({converted_amount:.2f} {display_currency_name}) в категории {category}"
-            
-            context.user_data['pending_expense'] = {
-                'amount': amount,
-                'currency': currency,
-                'category': category,
-                'source_type': 'photo',
-                'extracted_text': extracted_text
-            }
-            
-            keyboard = [
-                [
-                    InlineKeyboardButton("Подтвердить", callback_data="confirm_expense"),
-                    InlineKeyboardButton("Отменить", callback_data="cancel_expense")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
-                f"{preview_text}\n\nПодтвердите сохранение расхода:",
-                reply_markup=reply_markup
-            )
-        else:
-            logger.warning(f"Не удалось извлечь сумму из текста изображения пользователя {user_id}: {extracted_text[:100]}")
-            await update.message.reply_text(
-                f"Прочитано с изображения: {extracted_text}\n"
-                "Не удалось извлечь сумму расхода."
-            )
+        audio_stream = await download_media(bot, payload['file_id'], payload.get('file_size'))
+    except MediaTooLargeError as e:
+        raise PermanentJobError("голосовое сообщение слишком большое") from e
+    
+    try:
+        transcribed_text = await run_api(transcribe, audio_stream, payload.get('duration'))
+    finally:
+        audio_stream.close()
+    logger.info(f"Транскрипция голосового сообщения от пользователя {user_id}: {transcribed_text[:100]}")
+    expenses = await run_api(extract_expenses, transcribed_text)
+    
+    if expenses:
+        text, reply_markup = await build_expense_proposal(
+            user_id, expenses, 'voice',
+            prefix=f"Распознано: {transcribed_text}\n",
+            cached_settings=False,
+            transcribed_text=transcribed_text
+        )
+        await job_reply(bot, job, text, reply_markup)
+    else:
+        logger.warning(f"Не удалось извлечь сумму из транскрипции пользователя {user_id}: {transcribed_text[:100]}")
+        await job_reply(bot, job, f"Распознано: {transcribed_text}\nНе удалось извлечь сумму расхода.")
+
+async def process_photo_job(bot, job: dict):
+    user_id = job['user_id']
+    payload = job['payload']
+    begin_request(user_id)
+    
+    try:
+        image_stream = await download_media(bot, payload['file_id'], payload.get('file_size'))
+    except MediaTooLargeError as e:
+        raise PermanentJobError("изображение слишком большое") from e
+    
+    try:
+        image_url, image_digest = await run_api(prepare_image_for_ocr, image_stream)
+    finally:
+        image_stream.close()
+    extracted_text = await run_api(extract_text_from_image, image_url, image_digest)
+    logger.info(f"Текст из изображения от пользователя {user_id}: {extracted_text[:100]}")
+    expenses = await run_api(extract_expenses, extracted_text)
+    
+    if expenses:
+        text, reply_markup = await build_expense_proposal(
+            user_id, expenses, 'photo',
+            prefix=f"Прочитано с изображения: {extracted_text}\n",
+            cached_settings=False,
+            extracted_text=extracted_text
+        )
+        await job_reply(bot, job, text, reply_markup)
+    else:
+        logger.warning(f"Не удалось извлечь сумму из текста изображения пользователя {user_id}: {extracted_text[:100]}")
+        await job_reply(bot, job, f"Прочитано с изображения: {extracted_text}\nНе удалось извлечь сумму расхода.")
+
+register_job_handler('voice', process_voice_job)
+register_job_handler('photo', process_photo_job)
+
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    logger.info(f"Команда /import от пользователя {user_id}")
+    await update.message.reply_text(
+        "Отправьте CSV-файл с расходами или выписку из банка в формате CSV.\n\n"
+        "Обязательные колонки: дата и сумма.\n"
+        "Необязательные: валюта, категория, описание.\n"
+        "Если категории нет, она определяется по описанию.\n\n"
+        "В подписи к файлу можно указать валюту по умолчанию, например: USD"
+    )
+
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    document = update.message.document
+    logger.info(f"Получен CSV-файл {document.file_name} от пользователя {user_id}")
+    begin_request(user_id, timeout=IMPORT_REQUEST_DEADLINE)
+    
+    caption = (update.message.caption or '').strip()
+    default_currency = (find_currency(caption) if caption else None) or 'ARS'
+    
+    try:
+        csv_stream = await download_media(context.bot, document.file_id, document.file_size)
+    except MediaTooLargeError as e:
+        logger.warning(f"CSV-файл от пользователя {user_id} слишком большой: {str(e)}")
+        await update.message.reply_text("Файл слишком большой.")
+        return
+    except MediaDownloadError as e:
+        logger.warning(f"Не удалось загрузить CSV-файл от пользователя {user_id}: {str(e)}")
+        await update.message.reply_text("Не удалось загрузить файл. Попробуйте отправить его еще раз.")
+        return
+    
+    status_message = await update.message.reply_text("Импорт начат...")
+    loop = asyncio.get_running_loop()
+    last_progress = time.monotonic()
+    progress_update = None
+    
+    def report_progress(result):
+        nonlocal last_progress, progress_update
+        now = time.monotonic()
+        if now - last_progress < IMPORT_PROGRESS_INTERVAL:
+            return
+        if progress_update is not None and not progress_update.done():
+            return
+        last_progress = now
+        progress_update = asyncio.run_coroutine_threadsafe(
+            status_message.edit_text(f"Импорт... обработано строк: {result.imported + result.skipped + result.credits}"),
+            loop
+        )
+    
+    async def wait_for_progress():
+        if progress_update is None:
+            return
+        try:
+            await asyncio.wrap_future(progress_update)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить ход импорта для пользователя {user_id}: {str(e)}")
+    
+    try:
+        try:
+            result = await run_api(import_expenses_csv, csv_stream, user_id, default_currency, report_progress)
+        finally:
+            await wait_for_progress()
+        await status_message.edit_text(
+            f"Импорт завершен.\n"
+            f"Сохранено расходов: {result.imported}\n"
+            f"Валюта для строк без валюты: {default_currency}\n"
+            f"Пропущено строк: {result.skipped}\n"
+            f"Пропущено поступлений: {result.credits}\n"
+            f"Категорий определено локально: {result.categorized_locally}, через OpenAI: {result.categorized_by_model}"
+            + (f"\nНе удалось определить категорию (сохранено как «другие»): {result.uncategorized}" if result.uncategorized else "")
+        )
+    except CsvImportError as e:
+        logger.warning(f"Некорректный CSV-файл от пользователя {user_id}: {str(e)}")
+        await status_message.edit_text(f"Не удалось импортировать файл: {str(e)}")
     except Exception as e:
-        logger.error(f"Ошибка при обработке изображения от пользователя {user_id}: {str(e)}", exc_info=True)
-        await update.message.reply_text(f"Ошибка при обработке изображения: {str(e)}")
+        logger.error(f"Ошибка при импорте CSV от пользователя {user_id}: {str(e)}", exc_info=True)
+        await status_message.edit_text(f"Ошибка при импорте: {str(e)}")
+    finally:
+        csv_stream.close()
+
+CATEGORY_NAMES = {
+    'еда': '🍔 Еда',
+    'транспорт': '🚗 Транспорт',
+    'развлечения': '🎬 Развлечения',
+    'коммунальные': '🏠 Коммунальные',
+    'одежда': '👕 Одежда',
+    'здоровье': '💊 Здоровье',
+    'другие': '📦 Другие'
+}
+
+def get_category_name(category: str) -> str:
+    return CATEGORY_NAMES.get(category, category.capitalize())
+
+def format_totals(title: str, totals: dict, display_currency_name: str) -> str:
+    if not totals:
+        return f"<b>{title}:</b>\n0 {display_currency_name}"
+    
+    lines = [f"<b>{title}:</b>"]
+    for category, total in sorted(totals.items()):
+        lines.append(f"{get_category_name(category)}: {format_amount(total)} {display_currency_name}")
+    return "\n".join(lines)
+
+def format_change(current: float, previous: float) -> str:
+    if previous == 0:
+        return "новое" if current else "0%"
+    change = (current - previous) / previous * 100
+    return f"{change:+.0f}%"
+
+def format_comparison(title: str, current: dict, previous: dict, display_currency_name: str) -> str:
+    lines = [f"<b>{title}:</b>"]
+    for category in sorted(set(current) | set(previous)):
+        now_total = current.get(category, 0)
+        before_total = previous.get(category, 0)
+        lines.append(
+            f"{get_category_name(category)}: {format_amount(now_total)} {display_currency_name} "
+            f"(было {format_amount(before_total)}, {format_change(now_total, before_total)})"
+        )
+    now_sum = sum(current.values())
+    before_sum = sum(previous.values())
+    lines.append(
+        f"<b>Итого:</b> {format_amount(now_sum)} {display_currency_name} "
+        f"(было {format_amount(before_sum)}, {format_change(now_sum, before_sum)})"
+    )
+    return "\n".join(lines)
+
+CHART_ARGS = ('chart', 'график')
+
+def wants_chart(args: list[str]) -> bool:
+    return any(arg.lower() in CHART_ARGS for arg in args or [])
+
+async def send_chart(update: Update, user_id: int, title: str, totals: dict,
+                     start_date: date, end_date: date, display_currency_name: str):
+    if not totals:
+        return
+    try:
+        daily = await run_db(get_daily_series, start_date, end_date, user_id)
+        png = await render_chart(user_id, f"{start_date}:{end_date}", title, totals, daily, display_currency_name)
+        await update.message.reply_photo(photo=png)
+    except Exception as e:
+        logger.error(f"Ошибка при построении графика для пользователя {user_id}: {str(e)}", exc_info=True)
+        await update.message.reply_text("Не удалось построить график.")
 
 async def today_summary(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    totals = get_today_total(user_id)
+    totals = await run_db(get_today_total, user_id)
     logger.info(f"Команда /today от пользователя {user_id}")
     
-    settings = get_user_settings(user_id)
-    display_currency = settings['display_currency']
-    display_currency_name = get_currency_name(display_currency)
-    
-    if totals:
-        lines = ["<b>Расходы за сегодня:</b>"]
-        category_names = {
-            'еда': '🍔 Еда',
-            'транспорт': '🚗 Транспорт',
-            'развлечения': '🎬 Развлечения',
-            'коммунальные': '🏠 Коммунальные',
-            'одежда': '👕 Одежда',
-            'здоровье': '💊 Здоровье',
-            'другие': '📦 Другие'
-        }
-        for category, total in sorted(totals.items()):
-            cat_name = category_names.get(category, category.capitalize())
-            formatted_amount = format_amount(total)
-            lines.append(f"{cat_name}: {formatted_amount} {display_currency_name}")
-        message = "\n".join(lines)
-    else:
-        message = f"<b>Расходы за сегодня:</b>\n0 {display_currency_name}"
+    settings = await run_db(get_user_settings, user_id)
+    display_currency_name = get_currency_name(settings['display_currency'])
     
+    message = format_totals("Расходы за сегодня", totals, display_currency_name)
     await update.message.reply_text(message, parse_mode='HTML')
 
 async def month_summary(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    totals = get_month_total(user_id)
+    totals = await run_db(get_month_total, user_id)
     logger.info(f"Команда /month от пользователя {user_id}")
     
-    settings = get_user_settings(user_id)
-    display_currency = settings['display_currency']
-    display_currency_name = get_currency_name(display_currency)
-    
-    if totals:
-        lines = ["<b>Расходы за текущий месяц:</b>"]
-        category_names = {
-            'еда': '🍔 Еда',
-            'транспорт': '🚗 Транспорт',
-            'развлечения': '🎬 Развлечения',
-            'коммунальные': '🏠 Коммунальные',
-            'одежда': '👕 Одежда',
-            'здоровье': '💊 Здоровье',
-            'другие': '📦 Другие'
-        }
-        for category, total in sorted(totals.items()):
-            cat_name = category_names.get(category, category.capitalize())
-            formatted_amount = format_amount(total)
-            lines.append(f"{cat_name}: {formatted_amount} {display_currency_name}")
-        message = "\n".join(lines)
-    else:
-        message = f"<b>Расходы за текущий месяц:</b>\n0 {display_currency_name}"
+    settings = await run_db(get_user_settings, user_id)
+    display_currency_name = get_currency_name(settings['display_currency'])
     
+    message = format_totals("Расходы за текущий месяц", totals, display_currency_name)
     await update.message.reply_text(message, parse_mode='HTML')
+    
+    if wants_chart(context.args):
+        today = date.today()
+        await send_chart(update, user_id, "Расходы за текущий месяц", totals,
+                         *month_bounds(today.year, today.month), display_currency_name)
+
+def parse_report_date(value: str) -> date:
+    for date_format in ('%Y-%m-%d', '%d.%m.%Y'):
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Неизвестный формат даты: {value}")
+
+async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    logger.info(f"Команда /report от пользователя {user_id}: {context.args}")
+    
+    args = [arg.lower() for arg in context.args or [] if arg.lower() not in CHART_ARGS]
+    today = date.today()
+    tomorrow = today + timedelta(days=1)
+    comparison = False
+    
+    try:
+        if args == ['week']:
+            title = "Расходы за последние 7 дней"
+            periods = [(today - timedelta(days=6), tomorrow)]
+        elif args == ['ytd']:
+            title = f"Расходы с начала {today.year} года"
+            periods = [(date(today.year, 1, 1), tomorrow)]
+        elif args == ['mom']:
+            comparison = True
+            month_start = date(today.year, today.month, 1)
+            previous = month_start - timedelta(days=1)
+            previous_start, previous_month_end = month_bounds(previous.year, previous.month)
+            previous_end = min(previous_start + timedelta(days=today.day), previous_month_end)
+            title = (
+                f"С {month_start:%d.%m} по {today:%d.%m} по сравнению "
+                f"с {previous_start:%d.%m} по {previous_end - timedelta(days=1):%d.%m}"
+            )
+            periods = [(month_start, tomorrow), (previous_start, previous_end)]
+        elif len(args) == 2:
+            start_date, end_date = parse_report_date(args[0]), parse_report_date(args[1])
+            if end_date < start_date:
+                raise ValueError("Конечная дата раньше начальной")
+            title = f"Расходы с {start_date:%d.%m.%Y} по {end_date:%d.%m.%Y}"
+            periods = [(start_date, end_date + timedelta(days=1))]
+        else:
+            raise ValueError("Неизвестный период")
+    except ValueError:
+        await update.message.reply_text(
+            "Используйте:\n"
+            "/report week - последние 7 дней\n"
+            "/report ytd - с начала года\n"
+            "/report mom - начало текущего месяца по сравнению с теми же днями прошлого\n"
+            "/report 2025-01-01 2025-03-31 - произвольный период\n\n"
+            "Добавьте chart, чтобы получить график, например: /report week chart"
+        )
+        return
+    
+    totals = await run_db(get_expenses_by_periods, periods, user_id)
+    settings = await run_db(get_user_settings, user_id)
+    display_currency_name = get_currency_name(settings['display_currency'])
+    
+    if comparison:
+        message = format_comparison(title, totals[0], totals[1], display_currency_name)
+    else:
+        message = format_totals(title, totals[0], display_currency_name)
+    await update.message.reply_text(message, parse_mode='HTML')
+    
+    if wants_chart(context.args):
+        await send_chart(update, user_id, title, totals[0], *periods[0], display_currency_name)
 
 async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     logger.info(f"Команда /settings от пользователя {user_id}")
     
-    settings = get_user_settings(user_id)
+    settings = await run_db(get_user_settings, user_id)
     display_currency = settings['display_currency']
     
     keyboard = [
@@ -327,56 +597,51 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     settings_text = f"Ваша валюта отображения: {get_currency_name(display_currency)}\n\n"
     settings_text += "Выберите валюту для отображения:\n\n"
     settings_text += "Для установки курсов используйте команду /setrate\n"
-    settings_text += "Формат: /setrate USD 1000 (1 USD = 1000 ARS)"
+    settings_text += "Формат: /setrate USD 1000 (1 USD = 1000 ARS)\n\n"
+    settings_text += get_rates_status_text()
     
     await update.message.reply_text(settings_text, reply_markup=reply_markup)
 
 async def expense_confirmation_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
+    action, _, pending_id = query.data.partition(':')
     
-    if 'pending_expense' not in context.user_data:
+    if not pending_id:
         await query.answer("Расход не найден. Попробуйте снова.")
         await query.edit_message_text("Расход не найден. Попробуйте отправить расход снова.")
         return
+    pending_id = int(pending_id)
     
-    pending = context.user_data['pending_expense']
-    
-    if query.data == "confirm_expense":
+    if action == "confirm_expense":
         await query.answer()
         
-        amount = pending['amount']
-        currency = pending['currency']
-        category = pending['category']
-        
-        add_expense(amount, currency, category, user_id)
-        today_totals = get_today_total(user_id)
+        result = await confirm_pending(pending_id, user_id)
+        if result is None:
+            await query.edit_message_text("Расход не найден или уже обработан. Попробуйте отправить расход снова.")
+            return
         
-        currency_name = get_currency_name(currency)
-        settings = get_user_settings(user_id)
-        display_currency = settings['display_currency']
-        display_currency_name = get_currency_name(display_currency)
+        expenses, today_totals = result
+        ctx = await run_db(get_conversion_context, user_id)
+        display_currency_name = get_currency_name(ctx.display_currency)
         
-        if currency == display_currency:
-            summary_lines = [f"Расход {amount:.2f} {currency_name} в категории {category} сохранен."]
+        if len(expenses) == 1:
+            summary_lines = [f"Расход {describe_expense(expenses[0], ctx)} сохранен."]
         else:
-            converted_amount = convert_currency(amount, currency, user_id)
-            summary_lines = [f"Расход {amount:.2f} {currency_name} ({converted_amount:.2f} {display_currency_name}) в категории {category} сохранен."]
+            summary_lines = [f"Сохранено расходов: {len(expenses)}"] + describe_expenses(expenses, ctx)
         
         if today_totals:
             total_display = sum(today_totals.values())
             summary_lines.append(f"\nВсего за сегодня: {total_display:.2f} {display_currency_name}")
         
-        del context.user_data['pending_expense']
-        
         await query.edit_message_text("\n".join(summary_lines))
-        logger.info(f"Расход {amount:.2f} {currency} ({category}) сохранен для пользователя {user_id}")
+        logger.info(f"Сохранено расходов: {len(expenses)} для пользователя {user_id}")
         
-    elif query.data == "cancel_expense":
+    elif action == "cancel_expense":
         await query.answer("Расход отменен")
-        del context.user_data['pending_expense']
+        await run_db(discard_pending, pending_id, user_id)
         await query.edit_message_text("Сохранение расхода отменено.")
-        logger.info(f"Сохранение расхода отменено пользователем {user_id}")
+        logger.info(f"Сохранение расхода {pending_id} отменено пользователем {user_id}")
 
 async def currency_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -386,9 +651,9 @@ async def currency_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     currency = query.data.split('_')[1]
     
     logger.info(f"Изменение валюты отображения для пользователя {user_id} на {currency}")
-    set_display_currency(user_id, currency)
+    await run_db(set_display_currency, user_id, currency)
     
-    settings = get_user_settings(user_id)
+    settings = await run_db(get_user_settings, user_id)
     display_currency = settings['display_currency']
     
     keyboard = [
@@ -403,7 +668,8 @@ async def currency_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     settings_text = f"Ваша валюта отображения: {get_currency_name(display_currency)}\n\n"
     settings_text += "Выберите валюту для отображения:\n\n"
     settings_text += "Для установки курсов используйте команду /setrate\n"
-    settings_text += "Формат: /setrate USD 1000 (1 USD = 1000 ARS)"
+    settings_text += "Формат: /setrate USD 1000 (1 USD = 1000 ARS)\n\n"
+    settings_text += get_rates_status_text()
     
     await query.edit_message_text(settings_text, reply_markup=reply_markup)
 
@@ -432,44 +698,166 @@ async def setrate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Поддерживаются только USD и RUB.")
         return
     
-    set_exchange_rate(user_id, currency, 'ARS', rate)
+    await run_db(set_exchange_rate, user_id, currency, 'ARS', rate)
     currency_name = get_currency_name(currency)
     await update.message.reply_text(f"Курс установлен: 1 {currency_name} = {rate:.2f} песо")
 
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    logger.info(f"Команда /export от пользователя {user_id}")
+    
+    export_format = 'csv'
+    start_date = end_date = None
+    for arg in context.args or []:
+        if arg.lower() in EXPORT_FORMATS:
+            export_format = arg.lower()
+        elif arg.isdigit() and len(arg) == 4:
+            start_date, end_date = date(int(arg), 1, 1), date(int(arg) + 1, 1, 1)
+        else:
+            await update.message.reply_text(
+                "Используйте: /export [csv|parquet] [год]\n\n"
+                "Примеры:\n"
+                "/export\n"
+                "/export parquet 2025"
+            )
+            return
+    
+    out = tempfile.SpooledTemporaryFile(max_size=MEDIA_SPOOL_MEMORY_BYTES)
+    try:
+        count = await run_db(export_expenses, user_id, out, export_format, start_date, end_date)
+        if count == 0:
+            await update.message.reply_text("Нет расходов для выгрузки.")
+            return
+        
+        size = out.tell()
+        if size > EXPORT_MAX_UPLOAD_BYTES:
+            logger.warning(f"Экспорт пользователя {user_id} слишком большой для отправки: {size} байт")
+            await update.message.reply_text("Выгрузка слишком большая для Telegram. Укажите год, например: /export 2025")
+            return
+        
+        out.seek(0)
+        period = str(start_date.year) if start_date else 'all'
+        await update.message.reply_document(
+            document=out,
+            filename=f"expenses_{period}.{export_format}",
+            caption=f"Выгружено расходов: {count}"
+        )
+    except ExportFormatError as e:
+        await update.message.reply_text(str(e))
+    except Exception as e:
+        logger.error(f"Ошибка при экспорте расходов пользователя {user_id}: {str(e)}", exc_info=True)
+        await update.message.reply_text(f"Ошибка при экспорте: {str(e)}")
+    finally:
+        out.close()
+
+BOT_COMMANDS = [
+    BotCommand("start", "Начать работу с ботом"),
+    BotCommand("help", "Показать справку по командам"),
+    BotCommand("today", "Показать расходы за сегодня"),
+    BotCommand("month", "Показать расходы за текущий месяц"),
+    BotCommand("report", "Отчет за период"),
+    BotCommand("settings", "Настройки валюты отображения"),
+    BotCommand("setrate", "Установить курс валюты"),
+    BotCommand("import", "Импорт расходов из CSV"),
+    BotCommand("export", "Выгрузить расходы в файл")
+]
+
 async def set_bot_commands(application: Application):
-    commands = [
-        BotCommand("start", "Начать работу с ботом"),
-        BotCommand("help", "Показать справку по командам"),
-        BotCommand("today", "Показать расходы за сегодня"),
-        BotCommand("month", "Показать расходы за текущий месяц"),
-        BotCommand("settings", "Настройки валюты отображения"),
-        BotCommand("setrate", "Установить курс валюты")
-    ]
-    await application.bot.set_my_commands(commands)
+    await application.bot.set_my_commands(BOT_COMMANDS)
     logger.info("Меню команд установлено")
 
-def main():
-    logger.info("Запуск бота...")
-    init_db()
-    logger.info("База данных инициализирована")
-    
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).post_init(set_bot_commands).build()
+async def start_background_jobs(application: Application):
+    start_job_runner(application.bot)
+    start_stats_logger()
+
+async def post_init(application: Application):
+    await set_bot_commands(application)
+    await start_background_jobs(application)
+
+async def stop_background_jobs(application: Application):
+    await stop_job_runner()
+    await stop_confirmation_batcher()
+    await stop_stats_logger()
+
+async def shutdown(application: Application):
+    close_backend()
+    close_chart_renderer()
+    await close_media_client()
+    stop_rate_refresher()
+    shutdown_executors()
+    close_pool()
+
+def get_api_urls() -> dict:
+    if not TELEGRAM_API_BASE_URL:
+        return {}
+    api_base_url = TELEGRAM_API_BASE_URL.rstrip('/')
+    return {'base_url': f"{api_base_url}/bot", 'base_file_url': f"{api_base_url}/file/bot"}
+
+def get_webhook_options() -> dict:
+    return {
+        'listen': WEBHOOK_LISTEN,
+        'port': WEBHOOK_PORT,
+        'url_path': WEBHOOK_PATH,
+        'webhook_url': f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+        'secret_token': WEBHOOK_SECRET_TOKEN,
+        'max_connections': WEBHOOK_MAX_CONNECTIONS,
+        'allowed_updates': ALLOWED_UPDATES,
+    }
+
+def build_application(with_updater: bool = True) -> Application:
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(UserOrderedUpdateProcessor(CONCURRENT_UPDATES))
+        .post_init(post_init)
+        .post_stop(stop_background_jobs)
+        .post_shutdown(shutdown)
+    )
+    api_urls = get_api_urls()
+    if api_urls:
+        logger.info(f"Используется Bot API по адресу {TELEGRAM_API_BASE_URL}")
+        builder = builder.base_url(api_urls['base_url']).base_file_url(api_urls['base_file_url'])
+    if not with_updater:
+        builder = builder.updater(None)
+    application = builder.build()
     
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("today", today_summary))
     application.add_handler(CommandHandler("month", month_summary))
+    application.add_handler(CommandHandler("report", report_command))
     application.add_handler(CommandHandler("settings", settings_command))
     application.add_handler(CommandHandler("setrate", setrate_command))
-    application.add_handler(CallbackQueryHandler(expense_confirmation_callback, pattern="^(confirm_expense|cancel_expense)$"))
+    application.add_handler(CommandHandler("import", import_command))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CallbackQueryHandler(expense_confirmation_callback, pattern=r"^(confirm_expense|cancel_expense)(:\d+)?$"))
     application.add_handler(CallbackQueryHandler(currency_callback, pattern="currency_"))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
     application.add_handler(MessageHandler(filters.VOICE, handle_voice))
     application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
+    application.add_handler(MessageHandler(filters.Document.FileExtension("csv"), handle_document, block=False))
+    return application
+
+def main():
+    logger.info("Запуск бота...")
+    init_db()
+    logger.info("База данных инициализирована")
     
-    logger.info("Бот запущен и готов к работе")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if BOT_WORKERS > 1:
+        webhook_options = get_webhook_options() if BOT_MODE == 'webhook' else None
+        run_sharded(BOT_WORKERS, build_application, set_bot_commands, start_background_jobs,
+                    webhook_options, ALLOWED_UPDATES)
+        return
+    
+    start_rate_refresher()
+    application = build_application()
+    
+    if BOT_MODE == 'webhook':
+        logger.info(f"Бот запущен в режиме webhook на {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+        application.run_webhook(**get_webhook_options())
+    else:
+        logger.info("Бот запущен и готов к работе")
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == "__main__":
     main()
-
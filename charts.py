@@ -0,0 +1,142 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from typing import Optional
+import asyncio
+import io
+import json
+import logging
+import multiprocessing
+import threading
+
+from config import CHART_WORKERS, CHART_CACHE_SIZE
+from model_cache import digest_bytes
+
+logger = logging.getLogger(__name__)
+
+def _render_chart(title: str, categories: list[tuple[str, float]], daily: list[tuple[str, float]], currency_name: str) -> bytes:
+    from matplotlib.figure import Figure
+    
+    figure = Figure(figsize=(11, 5), dpi=100)
+    figure.suptitle(title)
+    pie_axes, bar_axes = figure.subplots(1, 2, gridspec_kw={'width_ratios': [1, 1.4]})
+    
+    positive = [(name, total) for name, total in categories if total > 0]
+    if positive:
+        pie_axes.pie(
+            [total for _, total in positive],
+            labels=[name for name, _ in positive],
+            autopct='%1.0f%%',
+            startangle=90,
+            counterclock=False
+        )
+    pie_axes.set_title("По категориям")
+    pie_axes.axis('equal')
+    
+    if daily:
+        labels = [date.fromisoformat(day).strftime('%d.%m') for day, _ in daily]
+        bar_axes.bar(range(len(daily)), [total for _, total in daily], color='#4c72b0')
+        step = max(1, len(labels) // 12)
+        bar_axes.set_xticks(range(0, len(labels), step))
+        bar_axes.set_xticklabels(labels[::step], rotation=45, ha='right')
+    bar_axes.set_title("По дням")
+    bar_axes.set_ylabel(currency_name)
+    bar_axes.grid(axis='y', alpha=0.3)
+    
+    figure.tight_layout()
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+def _fill_gaps(daily: list[tuple[date, float]]) -> list[tuple[date, float]]:
+    if not daily:
+        return []
+    totals = dict(daily)
+    first, last = min(totals), max(totals)
+    return [(first + timedelta(days=i), totals.get(first + timedelta(days=i), 0.0))
+            for i in range((last - first).days + 1)]
+
+class ChartRenderer:
+    def __init__(self, workers: int, cache_size: int):
+        self.workers = workers
+        self.cache_size = cache_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidated': 0}
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                logger.info(f"Запуск пула процессов для графиков ({self.workers})")
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+    
+    @staticmethod
+    def data_version(title: str, categories: list, daily: list, currency_name: str) -> str:
+        payload = json.dumps([title, categories, daily, currency_name], ensure_ascii=False, sort_keys=True)
+        return digest_bytes(payload.encode('utf-8'))
+    
+    def _get_cached(self, key: tuple) -> Optional[bytes]:
+        with self._lock:
+            png = self._cache.get(key)
+            if png is not None:
+                self._cache.move_to_end(key)
+                self._stats['hits'] += 1
+            else:
+                self._stats['misses'] += 1
+            return png
+    
+    def _store(self, key: tuple, png: bytes):
+        user_id, period_key, _ = key
+        with self._lock:
+            stale = [k for k in self._cache if k[0] == user_id and k[1] == period_key and k != key]
+            for stale_key in stale:
+                del self._cache[stale_key]
+            self._stats['invalidated'] += len(stale)
+            self._cache[key] = png
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+    
+    async def render(self, user_id: int, period_key: str, title: str, totals: dict,
+                     daily: list[tuple[date, float]], currency_name: str) -> bytes:
+        categories = [(category.capitalize(), round(total, 2)) for category, total in sorted(totals.items())]
+        days = [(day.isoformat(), round(total, 2)) for day, total in _fill_gaps(daily)]
+        key = (user_id, period_key, self.data_version(title, categories, days, currency_name))
+        
+        png = self._get_cached(key)
+        if png is not None:
+            return png
+        
+        loop = asyncio.get_running_loop()
+        png = await loop.run_in_executor(self._get_executor(), _render_chart, title, categories, days, currency_name)
+        self._store(key, png)
+        logger.info(f"Построен график {period_key} для пользователя {user_id}: {len(png)} байт")
+        return png
+    
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._cache)
+        return stats
+    
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+chart_renderer = ChartRenderer(CHART_WORKERS, CHART_CACHE_SIZE)
+
+async def render_chart(user_id: int, period_key: str, title: str, totals: dict,
+                       daily: list[tuple[date, float]], currency_name: str) -> bytes:
+    return await chart_renderer.render(user_id, period_key, title, totals, daily, currency_name)
+
+def get_chart_stats() -> dict:
+    return chart_renderer.stats()
+
+def close_chart_renderer():
+    chart_renderer.close()
@@ -7,8 +7,97 @@ TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+DB_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL", "30"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "10"))
+
+API_EXECUTOR_WORKERS = int(os.getenv("API_EXECUTOR_WORKERS", "16"))
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+
+USER_SETTINGS_CACHE_TTL = float(os.getenv("USER_SETTINGS_CACHE_TTL", "300"))
+USER_SETTINGS_CACHE_SIZE = int(os.getenv("USER_SETTINGS_CACHE_SIZE", "10000"))
+
+EXCHANGE_RATES_PROVIDER = os.getenv("EXCHANGE_RATES_PROVIDER", "api")
+EXCHANGE_RATES_FIXTURE_PATH = os.getenv("EXCHANGE_RATES_FIXTURE_PATH", "exchange_rates.json")
+EXCHANGE_RATES_REFRESH_INTERVAL = float(os.getenv("EXCHANGE_RATES_REFRESH_INTERVAL", "3600"))
+EXCHANGE_RATES_RETRY_INTERVAL = float(os.getenv("EXCHANGE_RATES_RETRY_INTERVAL", "300"))
+EXCHANGE_RATES_STALE_AFTER = float(os.getenv("EXCHANGE_RATES_STALE_AFTER", "86400"))
+EXCHANGE_RATES_RELOAD_INTERVAL = float(os.getenv("EXCHANGE_RATES_RELOAD_INTERVAL", "60"))
+
+MODEL_CACHE_ENABLED = os.getenv("MODEL_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+MODEL_CACHE_MEMORY_SIZE = int(os.getenv("MODEL_CACHE_MEMORY_SIZE", "1000"))
+MODEL_CACHE_MAX_ENTRIES = int(os.getenv("MODEL_CACHE_MAX_ENTRIES", "100000"))
+
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+OPENAI_MAX_CONCURRENCY_PER_USER = int(os.getenv("OPENAI_MAX_CONCURRENCY_PER_USER", "2"))
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "30000"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "20"))
+OPENAI_REQUEST_DEADLINE = float(os.getenv("OPENAI_REQUEST_DEADLINE", "60"))
+
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "2048"))
+IMAGE_MAX_SHORT_SIDE = int(os.getenv("IMAGE_MAX_SHORT_SIDE", "768"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(20 * 1024 * 1024)))
+MEDIA_SPOOL_MEMORY_BYTES = int(os.getenv("MEDIA_SPOOL_MEMORY_BYTES", str(512 * 1024)))
+
+TRANSCRIPTION_BACKEND = os.getenv("TRANSCRIPTION_BACKEND", "api")
+LOCAL_STT_MODEL = os.getenv("LOCAL_STT_MODEL", "base")
+LOCAL_STT_COMPUTE_TYPE = os.getenv("LOCAL_STT_COMPUTE_TYPE", "int8")
+LOCAL_STT_LANGUAGE = os.getenv("LOCAL_STT_LANGUAGE", "ru")
+LOCAL_STT_WORKERS = int(os.getenv("LOCAL_STT_WORKERS", "2"))
+LOCAL_STT_MAX_DURATION = float(os.getenv("LOCAL_STT_MAX_DURATION", "15"))
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_MODEL_BATCH_SIZE = int(os.getenv("IMPORT_MODEL_BATCH_SIZE", "50"))
+IMPORT_REQUEST_DEADLINE = float(os.getenv("IMPORT_REQUEST_DEADLINE", "1800"))
+IMPORT_PROGRESS_INTERVAL = float(os.getenv("IMPORT_PROGRESS_INTERVAL", "3"))
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "5000"))
+EXPORT_MAX_UPLOAD_BYTES = int(os.getenv("EXPORT_MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "2"))
+CHART_CACHE_SIZE = int(os.getenv("CHART_CACHE_SIZE", "500"))
+
+PENDING_EXPENSE_TTL = int(os.getenv("PENDING_EXPENSE_TTL", str(7 * 24 * 3600)))
+CONFIRM_BATCH_INTERVAL = float(os.getenv("CONFIRM_BATCH_INTERVAL", "0.02"))
+CONFIRM_BATCH_MAX_SIZE = int(os.getenv("CONFIRM_BATCH_MAX_SIZE", "100"))
+CONFIRM_BATCH_CONCURRENCY = int(os.getenv("CONFIRM_BATCH_CONCURRENCY", "4"))
+CONFIRM_BATCH_LOCK_TIMEOUT = float(os.getenv("CONFIRM_BATCH_LOCK_TIMEOUT", "2"))
+
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443")))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL")
+
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+
+MEDIA_JOB_WORKERS = int(os.getenv("MEDIA_JOB_WORKERS", "4"))
+MEDIA_JOB_MAX_ATTEMPTS = int(os.getenv("MEDIA_JOB_MAX_ATTEMPTS", "3"))
+MEDIA_JOB_LEASE = float(os.getenv("MEDIA_JOB_LEASE", "300"))
+MEDIA_JOB_POLL_INTERVAL = float(os.getenv("MEDIA_JOB_POLL_INTERVAL", "2"))
+MEDIA_JOB_RETRY_DELAY = float(os.getenv("MEDIA_JOB_RETRY_DELAY", "10"))
+MEDIA_JOB_ATTACH_GRACE = float(os.getenv("MEDIA_JOB_ATTACH_GRACE", "30"))
+MEDIA_JOB_RETENTION = float(os.getenv("MEDIA_JOB_RETENTION", str(7 * 24 * 3600)))
+
+STATS_LOG_INTERVAL = float(os.getenv("STATS_LOG_INTERVAL", "300"))
+
 if not TELEGRAM_BOT_TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN не найден в переменных окружения")
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY не найден в переменных окружения")
-
+if BOT_MODE not in ('polling', 'webhook'):
+    raise ValueError(f"Неизвестный BOT_MODE: {BOT_MODE}, ожидается polling или webhook")
+if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+    raise ValueError("WEBHOOK_URL не найден в переменных окружения, он обязателен для BOT_MODE=webhook")
+if BOT_MODE == 'webhook' and not WEBHOOK_SECRET_TOKEN:
+    raise ValueError("WEBHOOK_SECRET_TOKEN не найден в переменных окружения, он обязателен для BOT_MODE=webhook")
@@ -0,0 +1,183 @@
+import psycopg2
+from psycopg2 import pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from contextlib import contextmanager
+import threading
+import logging
+import time
+
+from config import (
+    DATABASE_URL,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MAX_LIFETIME,
+    DB_POOL_HEALTH_CHECK_INTERVAL,
+    DB_POOL_ACQUIRE_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+class ConnectionPool:
+    def __init__(self, dsn: str, min_size: int, max_size: int, max_lifetime: float,
+                 health_check_interval: float, acquire_timeout: float):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+
+        self._pool = pool.ThreadedConnectionPool(min_size, max_size, dsn)
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._created_at = {}
+        self._released_at = {}
+        self._in_use = 0
+        self._counters = {
+            'acquired': 0,
+            'created': 0,
+            'discarded': 0,
+            'health_check_failures': 0,
+            'timeouts': 0,
+            'wait_time_total': 0.0,
+        }
+
+    def _is_expired(self, conn, now: float) -> bool:
+        if self.max_lifetime <= 0:
+            return False
+        return now - self._created_at.get(id(conn), now) > self.max_lifetime
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created_at.pop(id(conn), None)
+            self._released_at.pop(id(conn), None)
+            self._counters['discarded'] += 1
+        try:
+            self._pool.putconn(conn, close=True)
+        except Exception as e:
+            logger.warning(f"Ошибка при закрытии соединения с БД: {str(e)}")
+
+    def _health_check(self, conn) -> bool:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except psycopg2.Error as e:
+            logger.warning(f"Проверка соединения с БД не пройдена: {str(e)}")
+            with self._lock:
+                self._counters['health_check_failures'] += 1
+            return False
+
+    def getconn(self):
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            with self._lock:
+                self._counters['timeouts'] += 1
+            raise pool.PoolError(f"Не удалось получить соединение с БД за {self.acquire_timeout} с")
+
+        try:
+            while True:
+                conn = self._pool.getconn()
+                now = time.monotonic()
+                with self._lock:
+                    if id(conn) not in self._created_at:
+                        self._created_at[id(conn)] = now
+                        self._counters['created'] += 1
+                    idle_for = now - self._released_at.get(id(conn), now)
+
+                if conn.closed or self._is_expired(conn, now):
+                    self._discard(conn)
+                    continue
+                if idle_for > self.health_check_interval and not self._health_check(conn):
+                    self._discard(conn)
+                    continue
+                break
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self._counters['acquired'] += 1
+            self._counters['wait_time_total'] += time.monotonic() - started
+        return conn
+
+    def putconn(self, conn):
+        try:
+            broken = bool(conn.closed)
+            if not broken and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+
+            if broken or self._is_expired(conn, time.monotonic()):
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._released_at[id(conn)] = time.monotonic()
+                self._pool.putconn(conn)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats['in_use'] = self._in_use
+            stats['open'] = len(self._created_at)
+        stats['idle'] = max(0, stats['open'] - stats['in_use'])
+        stats['min_size'] = self.min_size
+        stats['max_size'] = self.max_size
+        return stats
+
+    def close(self):
+        self._pool.closeall()
+        with self._lock:
+            self._created_at.clear()
+            self._released_at.clear()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                logger.info(f"Создание пула соединений с БД ({DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE})")
+                _pool = ConnectionPool(
+                    DATABASE_URL,
+                    DB_POOL_MIN_SIZE,
+                    DB_POOL_MAX_SIZE,
+                    DB_POOL_MAX_LIFETIME,
+                    DB_POOL_HEALTH_CHECK_INTERVAL,
+                    DB_POOL_ACQUIRE_TIMEOUT,
+                )
+    return _pool
+
+def get_connection():
+    return get_pool().connection()
+
+def get_pool_stats() -> dict:
+    if _pool is None:
+        return {}
+    return _pool.stats()
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            logger.info(f"Закрытие пула соединений с БД: {_pool.stats()}")
+            _pool.close()
+            _pool = None
@@ -0,0 +1,261 @@
+from datetime import date, datetime, timezone
+from psycopg2.extras import Json, execute_values
+import json
+import logging
+import requests
+import threading
+
+from config import (
+    EXCHANGE_RATES_PROVIDER,
+    EXCHANGE_RATES_FIXTURE_PATH,
+    EXCHANGE_RATES_REFRESH_INTERVAL,
+    EXCHANGE_RATES_RETRY_INTERVAL,
+    EXCHANGE_RATES_STALE_AFTER,
+    EXCHANGE_RATES_RELOAD_INTERVAL,
+)
+from db import get_connection
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_RATES = {
+    'USD': 1.0,
+    'ARS': 900.0,
+    'RUB': 90.0,
+    'EUR': 1.1
+}
+
+class ExchangeRateApiProvider:
+    name = 'exchangerate-api'
+    url = "https://api.exchangerate-api.com/v4/latest/USD"
+    
+    def fetch(self) -> dict:
+        response = requests.get(self.url, timeout=5)
+        if response.status_code != 200:
+            raise RuntimeError(f"Ошибка получения курсов: код {response.status_code}")
+        data = response.json()
+        return {
+            'USD': 1.0,
+            'ARS': data['rates']['ARS'],
+            'RUB': data['rates']['RUB'],
+            'EUR': data['rates']['EUR']
+        }
+
+class FixtureRateProvider:
+    name = 'fixture'
+    
+    def __init__(self, path: str):
+        self.path = path
+    
+    def _load(self) -> dict:
+        with open(self.path, encoding='utf-8') as f:
+            data = json.load(f)
+        history = {}
+        for day, rates in data.items():
+            history[date.fromisoformat(day)] = {'USD': 1.0, **{k.upper(): float(v) for k, v in rates.items()}}
+        return history
+    
+    def fetch(self) -> dict:
+        history = self._load()
+        if not history:
+            raise RuntimeError(f"Файл с курсами {self.path} пуст")
+        return history[max(history)]
+    
+    def history(self) -> dict:
+        return self._load()
+
+def save_rate_history(history: dict):
+    rows = [
+        (currency, rate_date, per_usd)
+        for rate_date, rates in history.items()
+        for currency, per_usd in rates.items()
+    ]
+    if not rows:
+        return
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        execute_values(cursor, """
+            INSERT INTO exchange_rates_history (currency, rate_date, per_usd)
+            VALUES %s
+            ON CONFLICT (currency, rate_date) DO UPDATE SET per_usd = EXCLUDED.per_usd
+        """, rows)
+        conn.commit()
+    logger.info(f"Сохранены курсы валют за {len(history)} дн.")
+
+class RateService:
+    def __init__(self, provider, refresh_interval: float, retry_interval: float, stale_after: float):
+        self.provider = provider
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._rates = None
+        self._fetched_at = None
+        self._source = None
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def _set(self, rates: dict, fetched_at: datetime, source: str):
+        with self._lock:
+            self._rates = dict(rates)
+            self._fetched_at = fetched_at
+            self._source = source
+    
+    def get_rates(self) -> dict:
+        with self._lock:
+            if self._rates is not None:
+                return self._rates
+        return FALLBACK_RATES
+    
+    def age(self) -> float | None:
+        with self._lock:
+            fetched_at = self._fetched_at
+        if fetched_at is None:
+            return None
+        return (datetime.now(timezone.utc) - fetched_at).total_seconds()
+    
+    def is_stale(self) -> bool:
+        age = self.age()
+        return age is None or age > self.stale_after
+    
+    def status(self) -> dict:
+        with self._lock:
+            rates = dict(self._rates) if self._rates is not None else dict(FALLBACK_RATES)
+            fetched_at = self._fetched_at
+            source = self._source or 'fallback'
+        return {
+            'rates': rates,
+            'fetched_at': fetched_at,
+            'source': source,
+            'age': self.age(),
+            'is_stale': self.is_stale()
+        }
+    
+    def load_snapshot(self) -> bool:
+        try:
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT rates, fetched_at, source FROM exchange_rate_snapshot WHERE id = 1")
+                row = cursor.fetchone()
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке сохраненных курсов валют: {str(e)}", exc_info=True)
+            return False
+        
+        if row is None:
+            logger.info("Сохраненных курсов валют нет, до первого обновления используются резервные")
+            return False
+        
+        rates, fetched_at, source = row
+        with self._lock:
+            changed = fetched_at != self._fetched_at
+        self._set(rates, fetched_at, source)
+        if changed:
+            logger.info(f"Загружены сохраненные курсы валют от {fetched_at}: {rates}")
+        return True
+    
+    def _save_snapshot(self, rates: dict, fetched_at: datetime, source: str):
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO exchange_rate_snapshot (id, rates, fetched_at, source)
+                VALUES (1, %s, %s, %s)
+                ON CONFLICT (id) DO UPDATE SET rates = EXCLUDED.rates, fetched_at = EXCLUDED.fetched_at, source = EXCLUDED.source
+            """, (Json(rates), fetched_at, source))
+            execute_values(cursor, """
+                INSERT INTO exchange_rates_history (currency, rate_date, per_usd)
+                VALUES %s
+                ON CONFLICT (currency, rate_date) DO UPDATE SET per_usd = EXCLUDED.per_usd
+            """, [(currency, fetched_at.date(), per_usd) for currency, per_usd in rates.items()])
+            conn.commit()
+    
+    def load_history(self):
+        if not hasattr(self.provider, 'history'):
+            return
+        try:
+            save_rate_history(self.provider.history())
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке истории курсов валют: {str(e)}", exc_info=True)
+    
+    def refresh(self) -> bool:
+        logger.info("Запрос актуальных курсов валют")
+        try:
+            rates = self.provider.fetch()
+        except Exception as e:
+            logger.error(f"Ошибка при получении курсов валют: {str(e)}", exc_info=True)
+            if self.is_stale():
+                logger.warning(f"Курсы валют устарели, используются курсы из источника {self.status()['source']}")
+            return False
+        
+        fetched_at = datetime.now(timezone.utc)
+        self._set(rates, fetched_at, self.provider.name)
+        logger.info(f"Курсы валют получены: {rates}")
+        try:
+            self._save_snapshot(rates, fetched_at, self.provider.name)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении курсов валют: {str(e)}", exc_info=True)
+        return True
+    
+    def _run(self):
+        age = self.age()
+        if age is None or age >= self.refresh_interval:
+            delay = 0
+        else:
+            delay = self.refresh_interval - age
+        
+        while not self._stop.wait(delay):
+            delay = self.refresh_interval if self.refresh() else self.retry_interval
+    
+    def _follow(self, interval: float):
+        while not self._stop.wait(interval):
+            self.load_snapshot()
+    
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="exchange-rates", daemon=True)
+        self._thread.start()
+        logger.info(f"Фоновое обновление курсов валют запущено (каждые {self.refresh_interval:.0f} с)")
+    
+    def follow(self, interval: float):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._follow, args=(interval,), name="exchange-rates", daemon=True)
+        self._thread.start()
+        logger.info(f"Курсы валют перечитываются из базы каждые {interval:.0f} с")
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+def create_provider():
+    if EXCHANGE_RATES_PROVIDER == 'fixture':
+        return FixtureRateProvider(EXCHANGE_RATES_FIXTURE_PATH)
+    return ExchangeRateApiProvider()
+
+rate_service = RateService(
+    create_provider(),
+    EXCHANGE_RATES_REFRESH_INTERVAL,
+    EXCHANGE_RATES_RETRY_INTERVAL,
+    EXCHANGE_RATES_STALE_AFTER,
+)
+
+def get_exchange_rates() -> dict:
+    return rate_service.get_rates()
+
+def get_rates_status() -> dict:
+    return rate_service.status()
+
+def start_rate_refresher():
+    rate_service.load_snapshot()
+    rate_service.load_history()
+    rate_service.start()
+
+def start_rate_follower():
+    rate_service.load_snapshot()
+    rate_service.follow(EXCHANGE_RATES_RELOAD_INTERVAL)
+
+def stop_rate_refresher():
+    rate_service.stop()
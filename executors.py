@@ -0,0 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import functools
+import logging
+
+from config import DB_POOL_MAX_SIZE, API_EXECUTOR_WORKERS
+
+logger = logging.getLogger(__name__)
+
+_db_executor = ThreadPoolExecutor(max_workers=DB_POOL_MAX_SIZE, thread_name_prefix="db")
+_api_executor = ThreadPoolExecutor(max_workers=API_EXECUTOR_WORKERS, thread_name_prefix="api")
+
+async def _run_in(executor: ThreadPoolExecutor, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(executor, functools.partial(ctx.run, func, *args, **kwargs))
+
+async def run_db(func, *args, **kwargs):
+    return await _run_in(_db_executor, func, *args, **kwargs)
+
+async def run_api(func, *args, **kwargs):
+    return await _run_in(_api_executor, func, *args, **kwargs)
+
+def shutdown_executors():
+    logger.info("Остановка пулов потоков для БД и внешних API")
+    _db_executor.shutdown(wait=True, cancel_futures=True)
+    _api_executor.shutdown(wait=True, cancel_futures=True)
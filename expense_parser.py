@@ -1,11 +1,164 @@
-from openai_client import parse_expense_from_text, determine_expense_category
+from typing import Optional
+import logging
+import re
 
-def extract_expense(text: str) -> tuple[float, str]:
-    amount, currency = parse_expense_from_text(text)
-    return (amount, currency)
+from openai_client import (
+    extract_expenses_structured,
+    ExpenseExtraction,
+    CURRENCY_ALIASES,
+)
 
-def extract_expense_with_category(text: str) -> tuple[float, str, str]:
-    amount, currency = parse_expense_from_text(text)
-    category = determine_expense_category(text)
-    return (amount, currency, category)
+logger = logging.getLogger(__name__)
 
+LOCAL_PARSER_MAX_WORDS = 6
+
+NUMBER_RE = re.compile(r'\d{1,3}(?:[ \u00a0.,]\d{3})+(?:[.,]\d{1,2})?(?!\d)|\d+(?:[.,]\d{1,2})?(?!\d)')
+
+ITEM_SEPARATOR_RE = re.compile(r'\n+|;\s*|,\s+')
+
+MULTIPLIER_RE = re.compile(
+    r'(?:\s*(тысяч[аи]?|тыс\.?|млн\.?|миллион(?:а|ов)?)|(к|k)|\s+(к|k)(?=\s*$))(?![^\W\d_])',
+    re.IGNORECASE
+)
+
+MULTIPLIERS = {
+    'тысяч': 1000,
+    'тысяча': 1000,
+    'тысячи': 1000,
+    'тыс': 1000,
+    'к': 1000,
+    'k': 1000,
+    'млн': 1000000,
+    'миллион': 1000000,
+    'миллиона': 1000000,
+    'миллионов': 1000000,
+}
+
+LOCAL_CURRENCY_ALIASES = {
+    'RUB': ['р', 'руб', 'рублей', 'рубля', 'рубль'],
+    'ARS': ['песо', 'pesos', 'peso'],
+    'USD': ['usd', 'долл', 'доллар', 'долларов', 'доллара', 'бакс', 'баксов', 'бакса'],
+    'EUR': ['eur', 'евро', '€'],
+}
+
+CATEGORY_KEYWORDS = {
+    'еда': ['кофе', 'обед', 'ужин', 'завтрак', 'перекус', 'продукт', 'еда', 'еду', 'еды', 'ресторан', 'кафе', 'пицц',
+            'супермаркет', 'хлеб', 'молок', 'фрукт', 'овощ', 'мяс', 'рыб', 'сыр', 'доставк', 'бургер', 'суши'],
+    'транспорт': ['такси', 'uber', 'убер', 'метро', 'автобус', 'бензин', 'топлив', 'парковк', 'проезд',
+                  'поезд', 'электричк', 'каршеринг', 'самолет', 'авиабилет'],
+    'развлечения': ['кино', 'театр', 'концерт', 'бар', 'клуб', 'музе', 'игр', 'подписк', 'netflix',
+                    'spotify', 'боулинг', 'караоке'],
+    'коммунальные': ['свет', 'электричеств', 'газ', 'вод', 'интернет', 'аренд', 'квартплат', 'коммуналк',
+                     'коммунальн', 'жкх', 'телефон', 'связ'],
+    'одежда': ['одежд', 'обув', 'футболк', 'джинс', 'куртк', 'кроссовк', 'плать', 'рубашк', 'носк', 'брюк'],
+    'здоровье': ['аптек', 'лекарств', 'врач', 'доктор', 'стоматолог', 'анализ', 'таблетк', 'витамин',
+                 'клиник', 'массаж'],
+}
+
+WORD_ENDINGS = frozenset([
+    '', 'а', 'у', 'ы', 'е', 'и', 'о', 'ь', 'й', 'я', 'ю',
+    'ой', 'ом', 'ам', 'ами', 'ах', 'ов', 'ей', 'ем', 'ые', 'ых', 'ый', 'ое', 'ая', 'ую',
+])
+
+def parse_number(raw: str) -> float:
+    raw = re.sub(r'\s', '', raw)
+    separators = set(re.findall(r'[.,]', raw))
+    if not separators:
+        return float(raw)
+    
+    last = max(raw.rfind('.'), raw.rfind(','))
+    fraction = raw[last + 1:]
+    if len(separators) == 1 and len(fraction) == 3 and not re.match(r'0[.,]', raw):
+        return float(re.sub(r'[.,]', '', raw))
+    return float(re.sub(r'[.,]', '', raw[:last]) + '.' + fraction)
+
+def _match_currency(word: str) -> Optional[str]:
+    for code, aliases in LOCAL_CURRENCY_ALIASES.items():
+        if word in aliases:
+            return code
+    for code, aliases in CURRENCY_ALIASES.items():
+        if word.upper() in aliases:
+            return code
+    return None
+
+def find_currency(text: str) -> Optional[str]:
+    currencies = {_match_currency(word) for word in re.findall(r'[^\W\d_]+|[$€₽]', text.lower())}
+    currencies.discard(None)
+    return currencies.pop() if len(currencies) == 1 else None
+
+def _match_category(word: str) -> Optional[str]:
+    for category, stems in CATEGORY_KEYWORDS.items():
+        for stem in stems:
+            if word.startswith(stem) and word[len(stem):] in WORD_ENDINGS:
+                return category
+    return None
+
+def categorize_locally(text: str) -> Optional[str]:
+    categories = set()
+    for word in re.findall(r'[^\W\d_]+', text.lower()):
+        category = _match_category(word)
+        if category:
+            categories.add(category)
+    if len(categories) != 1:
+        return None
+    return categories.pop()
+
+def parse_expense_locally(text: str) -> Optional[ExpenseExtraction]:
+    numbers = list(NUMBER_RE.finditer(text))
+    if len(numbers) != 1:
+        return None
+    
+    number = numbers[0]
+    amount = parse_number(number.group())
+    rest_start = number.end()
+    
+    multiplier = MULTIPLIER_RE.match(text, rest_start)
+    if multiplier:
+        word = next(group for group in multiplier.groups() if group)
+        amount *= MULTIPLIERS[word.lower().rstrip('.')]
+        rest_start = multiplier.end()
+    
+    if amount <= 0:
+        return None
+    
+    rest = text[:number.start()] + ' ' + text[rest_start:]
+    words = re.findall(r'[^\W\d_]+|[$€₽]', rest.lower())
+    if len(words) > LOCAL_PARSER_MAX_WORDS:
+        return None
+    
+    currencies = set()
+    categories = set()
+    for word in words:
+        currency = _match_currency(word)
+        if currency:
+            currencies.add(currency)
+            continue
+        category = _match_category(word)
+        if category:
+            categories.add(category)
+    
+    if len(currencies) > 1 or len(categories) != 1:
+        return None
+    
+    currency = currencies.pop() if currencies else 'ARS'
+    return ExpenseExtraction(amount, currency, categories.pop())
+
+def parse_expenses_locally(text: str) -> Optional[list[ExpenseExtraction]]:
+    parts = [part for part in ITEM_SEPARATOR_RE.split(text) if part.strip()]
+    if not parts:
+        return None
+    
+    expenses = []
+    for part in parts:
+        expense = parse_expense_locally(part)
+        if expense is None:
+            return None
+        expenses.append(expense)
+    return expenses
+
+def extract_expenses(text: str) -> list[ExpenseExtraction]:
+    expenses = parse_expenses_locally(text)
+    if expenses is not None:
+        logger.info(f"Расходы разобраны локально: {len(expenses)}")
+        return expenses
+    return extract_expenses_structured(text)
@@ -0,0 +1,131 @@
+from datetime import date
+from typing import Optional
+import argparse
+import csv
+import importlib.util
+import io
+import logging
+import sys
+import uuid
+
+from config import EXPORT_CHUNK_SIZE
+from db import get_connection
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('csv', 'parquet')
+EXPORT_COLUMNS = ['date', 'amount', 'currency', 'category']
+
+class ExportFormatError(Exception):
+    pass
+
+def is_parquet_available() -> bool:
+    return importlib.util.find_spec('pyarrow') is not None
+
+def iter_expense_chunks(user_id: int, start_date: Optional[date] = None, end_date: Optional[date] = None):
+    conditions = ["user_id = %s"]
+    params = [user_id]
+    if start_date is not None:
+        conditions.append("date >= %s")
+        params.append(start_date.isoformat())
+    if end_date is not None:
+        conditions.append("date < %s")
+        params.append(end_date.isoformat())
+    
+    with get_connection() as conn:
+        cursor = conn.cursor(name=f"export_{uuid.uuid4().hex}")
+        cursor.itersize = EXPORT_CHUNK_SIZE
+        try:
+            cursor.execute(f"""
+                SELECT date, amount, COALESCE(currency, 'RUB'), COALESCE(category, 'другие')
+                FROM expenses
+                WHERE {' AND '.join(conditions)}
+                ORDER BY date, id
+            """, params)
+            while True:
+                rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+def _write_csv(chunks, out) -> int:
+    text = io.TextIOWrapper(out, encoding='utf-8', newline='')
+    try:
+        writer = csv.writer(text)
+        writer.writerow(EXPORT_COLUMNS)
+        count = 0
+        for rows in chunks:
+            writer.writerows((expense_date.isoformat(), amount, currency, category)
+                             for expense_date, amount, currency, category in rows)
+            count += len(rows)
+        text.flush()
+        return count
+    finally:
+        text.detach()
+
+def _write_parquet(chunks, out) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    schema = pa.schema([
+        ('date', pa.date32()),
+        ('amount', pa.float64()),
+        ('currency', pa.string()),
+        ('category', pa.string()),
+    ])
+    count = 0
+    with pq.ParquetWriter(out, schema, compression='zstd') as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema
+            ))
+            count += len(rows)
+    return count
+
+def export_expenses(user_id: int, out, export_format: str = 'csv',
+                    start_date: Optional[date] = None, end_date: Optional[date] = None) -> int:
+    if export_format not in EXPORT_FORMATS:
+        raise ExportFormatError(f"Неизвестный формат экспорта: {export_format}")
+    if export_format == 'parquet' and not is_parquet_available():
+        raise ExportFormatError("Для экспорта в Parquet нужен пакет pyarrow")
+    
+    logger.info(f"Экспорт расходов пользователя {user_id} в {export_format} за период {start_date} - {end_date}")
+    chunks = iter_expense_chunks(user_id, start_date, end_date)
+    if export_format == 'parquet':
+        count = _write_parquet(chunks, out)
+    else:
+        count = _write_csv(chunks, out)
+    logger.info(f"Экспортировано {count} расходов пользователя {user_id}")
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Экспорт расходов пользователя в CSV или Parquet")
+    parser.add_argument('--user-id', type=int, required=True)
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument('--from', dest='start_date', type=date.fromisoformat, help="начальная дата включительно, YYYY-MM-DD")
+    parser.add_argument('--to', dest='end_date', type=date.fromisoformat, help="конечная дата не включительно, YYYY-MM-DD")
+    parser.add_argument('--year', type=int, help="экспорт за календарный год")
+    parser.add_argument('--output', '-o', help="файл для записи; по умолчанию stdout")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', stream=sys.stderr)
+    
+    start_date, end_date = args.start_date, args.end_date
+    if args.year:
+        start_date, end_date = date(args.year, 1, 1), date(args.year + 1, 1, 1)
+    
+    try:
+        if args.output:
+            with open(args.output, 'wb') as out:
+                export_expenses(args.user_id, out, args.format, start_date, end_date)
+        else:
+            export_expenses(args.user_id, sys.stdout.buffer, args.format, start_date, end_date)
+    except ExportFormatError as e:
+        parser.error(str(e))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import argparse
+import itertools
+import json
+import logging
+import threading
+import time
+import urllib.error
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_expenses_bot'}
+
+class FakeBotApi:
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        self.calls = []
+        self.webhook = None
+        self._message_ids = itertools.count(1000)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def _message(self, params: dict) -> dict:
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(params.get('chat_id', self.chat_id)), 'type': 'private'},
+            'from': BOT_USER,
+        }
+        if 'text' in params:
+            message['text'] = params['text']
+        if 'reply_markup' in params:
+            message['reply_markup'] = params['reply_markup']
+        return message
+
+    def handle(self, method: str, params: dict):
+        with self._lock:
+            self.calls.append((method, params))
+            if method == 'setWebhook':
+                self.webhook = params
+            self._changed.notify_all()
+
+        if method == 'getMe':
+            return BOT_USER
+        if method in ('sendMessage', 'sendPhoto', 'sendDocument'):
+            return self._message(params)
+        if method == 'editMessageText':
+            message = self._message(params)
+            message['message_id'] = int(params.get('message_id', message['message_id']))
+            return message
+        if method == 'getWebhookInfo':
+            return {'url': (self.webhook or {}).get('url', ''), 'has_custom_certificate': False, 'pending_update_count': 0}
+        return True
+
+    def wait_for(self, predicate, timeout: float):
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                result = predicate()
+                if result:
+                    return result
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._changed.wait(remaining)
+
+    def calls_since(self, index: int) -> list:
+        with self._lock:
+            return self.calls[index:]
+
+def _decode_params(content_type: str, body: bytes) -> dict:
+    if content_type.startswith('application/json'):
+        params = json.loads(body or b'{}')
+    elif content_type.startswith('application/x-www-form-urlencoded'):
+        params = {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+    else:
+        return {'_body_bytes': len(body)}
+
+    decoded = {}
+    for key, value in params.items():
+        if isinstance(value, str) and value[:1] in ('{', '['):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        decoded[key] = value
+    return decoded
+
+def make_handler(api: FakeBotApi):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            method = self.path.rstrip('/').rsplit('/', 1)[-1]
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            params = _decode_params(self.headers.get('Content-Type', ''), body)
+            result = api.handle(method, params)
+            payload = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        do_GET = do_POST
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+    return Handler
+
+class UpdateSender:
+    def __init__(self, api: FakeBotApi, user_id: int):
+        self.api = api
+        self.user_id = user_id
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _user(self) -> dict:
+        return {'id': self.user_id, 'is_bot': False, 'first_name': 'Test', 'username': 'test_user'}
+
+    def post(self, update: dict, secret_token=None) -> int:
+        webhook = self.api.webhook
+        if secret_token is None:
+            secret_token = webhook.get('secret_token')
+        request = urllib.request.Request(
+            webhook['url'],
+            data=json.dumps(update).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        if secret_token:
+            request.add_header('X-Telegram-Bot-Api-Secret-Token', secret_token)
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                with urllib.request.urlopen(request, timeout=10) as response:
+                    return response.status
+            except urllib.error.HTTPError as e:
+                return e.code
+            except urllib.error.URLError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.2)
+
+    def message(self, text: str) -> dict:
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': self.user_id, 'type': 'private'},
+            'from': self._user(),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': next(self._update_ids), 'message': message}
+
+    def callback(self, data: str, message: dict) -> dict:
+        return {
+            'update_id': next(self._update_ids),
+            'callback_query': {
+                'id': str(next(self._update_ids)),
+                'from': self._user(),
+                'chat_instance': str(self.user_id),
+                'data': data,
+                'message': message,
+            }
+        }
+
+def _find_button(calls: list) -> tuple:
+    for method, params in calls:
+        markup = params.get('reply_markup')
+        if method == 'sendMessage' and isinstance(markup, dict) and markup.get('inline_keyboard'):
+            keyboard = markup['inline_keyboard']
+            message = {
+                'message_id': 0,
+                'date': int(time.time()),
+                'chat': {'id': int(params['chat_id']), 'type': 'private'},
+                'from': BOT_USER,
+                'text': params.get('text', ''),
+            }
+            return keyboard[0][0]['callback_data'], message
+    return None, None
+
+def _print_calls(calls: list):
+    for method, params in calls:
+        text = params.get('text') or params.get('caption') or ''
+        print(f"  <- {method} {text}".rstrip())
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный Bot API для проверки бота в режиме webhook")
+    parser.add_argument('--port', type=int, default=8081, help="порт фейкового Bot API")
+    parser.add_argument('--user-id', type=int, default=100000001)
+    parser.add_argument('--text', action='append', default=[], help="сообщение пользователя; можно указать несколько раз")
+    parser.add_argument('--confirm', action='store_true', help="нажимать первую кнопку под ответом бота")
+    parser.add_argument('--timeout', type=float, default=30, help="сколько секунд ждать ответа бота")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    api = FakeBotApi(args.user_id)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(api))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Фейковый Bot API слушает http://127.0.0.1:{args.port}")
+    print(f"Запустите бота с BOT_MODE=webhook TELEGRAM_API_BASE_URL=http://127.0.0.1:{args.port}")
+
+    try:
+        if not api.wait_for(lambda: api.webhook, timeout=300):
+            print("Бот не вызвал setWebhook")
+            return
+        webhook = api.webhook
+        print(f"Webhook: {webhook.get('url')}, allowed_updates: {webhook.get('allowed_updates')}")
+
+        sender = UpdateSender(api, args.user_id)
+        status = sender.post(sender.message('/start'), secret_token='wrong-secret')
+        print(f"Запрос с неверным секретом: HTTP {status}")
+
+        for text in args.text:
+            start = len(api.calls)
+            status = sender.post(sender.message(text))
+            print(f"-> {text} (HTTP {status})")
+            if not api.wait_for(lambda: any(m in ('sendMessage', 'sendPhoto', 'sendDocument')
+                                            for m, _ in api.calls[start:]), args.timeout):
+                print("  нет ответа")
+                continue
+            time.sleep(0.5)
+            calls = api.calls_since(start)
+            _print_calls(calls)
+
+            callback_data, message = _find_button(calls)
+            if args.confirm and callback_data:
+                start = len(api.calls)
+                status = sender.post(sender.callback(callback_data, message))
+                print(f"-> кнопка {callback_data} (HTTP {status})")
+                api.wait_for(lambda: any(m == 'editMessageText' for m, _ in api.calls[start:]), args.timeout)
+                _print_calls(api.calls_since(start))
+
+        if not args.text:
+            print("Нажмите Ctrl+C для выхода")
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
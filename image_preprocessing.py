@@ -0,0 +1,110 @@
+from PIL import Image, ImageChops, ImageOps
+import logging
+import math
+import tempfile
+import threading
+
+from config import IMAGE_MAX_SIDE, IMAGE_MAX_SHORT_SIDE, IMAGE_JPEG_QUALITY, MEDIA_SPOOL_MEMORY_BYTES
+from media import encode_data_url, stream_size
+from model_cache import digest_stream
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_stats = {
+    'images': 0,
+    'bytes_in': 0,
+    'bytes_out': 0,
+    'tokens_in': 0,
+    'tokens_out': 0,
+}
+
+def choose_photo_size(photos):
+    sizes = sorted(photos, key=lambda p: p.width * p.height)
+    for photo in sizes:
+        if min(photo.width, photo.height) >= IMAGE_MAX_SHORT_SIDE or max(photo.width, photo.height) >= IMAGE_MAX_SIDE:
+            return photo
+    return sizes[-1]
+
+def estimate_vision_tokens(width: int, height: int) -> int:
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+def detect_mime_type(stream) -> str:
+    stream.seek(0)
+    data = stream.read(12)
+    stream.seek(0)
+    if data.startswith(b'\x89PNG'):
+        return 'image/png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[:3] == b'GIF':
+        return 'image/gif'
+    return 'image/jpeg'
+
+def _trim_border(image: Image.Image) -> Image.Image:
+    background = Image.new(image.mode, image.size, image.getpixel((0, 0)))
+    diff = ImageChops.difference(image, background)
+    bbox = ImageChops.add(diff, diff, 2.0, -20).getbbox()
+    if bbox is None:
+        return image
+    return image.crop(bbox)
+
+def preprocess_image(stream):
+    size_in = stream_size(stream)
+    stream.seek(0)
+    image = Image.open(stream)
+    image = ImageOps.exif_transpose(image)
+    tokens_in = estimate_vision_tokens(*image.size)
+    
+    image = ImageOps.grayscale(image)
+    image = _trim_border(image)
+    image = ImageOps.autocontrast(image, cutoff=1)
+    
+    width, height = image.size
+    scale = min(1.0, IMAGE_MAX_SIDE / max(width, height))
+    if min(width, height) * scale > IMAGE_MAX_SHORT_SIDE:
+        scale = min(scale, IMAGE_MAX_SHORT_SIDE / min(width, height))
+    if scale < 1.0:
+        image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+    
+    output = tempfile.SpooledTemporaryFile(max_size=MEDIA_SPOOL_MEMORY_BYTES)
+    image.save(output, format='JPEG', quality=IMAGE_JPEG_QUALITY, optimize=True)
+    size_out = output.tell()
+    tokens_out = estimate_vision_tokens(*image.size)
+    
+    if size_out >= size_in and tokens_out >= tokens_in:
+        output.close()
+        return stream, detect_mime_type(stream)
+    
+    with _stats_lock:
+        _stats['images'] += 1
+        _stats['bytes_in'] += size_in
+        _stats['bytes_out'] += size_out
+        _stats['tokens_in'] += tokens_in
+        _stats['tokens_out'] += tokens_out
+    logger.info(f"Изображение подготовлено: {size_in} -> {size_out} байт, ~{tokens_in} -> ~{tokens_out} токенов")
+    output.seek(0)
+    return output, 'image/jpeg'
+
+def prepare_image_for_ocr(stream) -> tuple[str, str]:
+    try:
+        prepared, mime_type = preprocess_image(stream)
+    except Exception as e:
+        logger.warning(f"Не удалось обработать изображение, отправляется оригинал: {str(e)}")
+        prepared, mime_type = stream, detect_mime_type(stream)
+    try:
+        return encode_data_url(prepared, mime_type), digest_stream(prepared)
+    finally:
+        if prepared is not stream:
+            prepared.close()
+
+def get_preprocessing_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['bytes_saved'] = stats['bytes_in'] - stats['bytes_out']
+    stats['tokens_saved'] = stats['tokens_in'] - stats['tokens_out']
+    return stats
@@ -0,0 +1,213 @@
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Optional
+import csv
+import io
+import logging
+import re
+import tempfile
+
+from config import IMPORT_BATCH_SIZE, IMPORT_MODEL_BATCH_SIZE, MEDIA_SPOOL_MEMORY_BYTES
+from db import get_connection
+from expense_parser import categorize_locally, parse_number
+from openai_client import EXPENSE_CATEGORIES, categorize_batch, normalize_currency
+
+logger = logging.getLogger(__name__)
+
+HEADER_ALIASES = {
+    'date': ['date', 'дата', 'fecha', 'transaction date', 'дата операции'],
+    'amount': ['amount', 'сумма', 'importe', 'monto', 'сумма операции'],
+    'debit': ['debit', 'расход', 'списание', 'debe', 'débito'],
+    'credit': ['credit', 'приход', 'поступление', 'зачисление', 'haber', 'crédito'],
+    'currency': ['currency', 'валюта', 'moneda'],
+    'category': ['category', 'категория', 'categoria'],
+    'description': ['description', 'описание', 'comment', 'комментарий', 'назначение', 'concepto', 'descripcion', 'details'],
+}
+
+DATE_FORMATS = ['%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d', '%d.%m.%y', '%d/%m/%y']
+
+class CsvImportError(Exception):
+    pass
+
+@dataclass
+class ImportResult:
+    imported: int = 0
+    skipped: int = 0
+    credits: int = 0
+    categorized_locally: int = 0
+    categorized_by_model: int = 0
+    uncategorized: int = 0
+
+def _detect_columns(header: list[str]) -> dict:
+    normalized = [column.strip().lower() for column in header]
+    columns = {}
+    for name, aliases in HEADER_ALIASES.items():
+        for index, column in enumerate(normalized):
+            if column in aliases:
+                columns[name] = index
+                break
+    if 'date' not in columns or ('amount' not in columns and 'debit' not in columns):
+        raise CsvImportError("В файле должны быть колонки с датой и суммой")
+    return columns
+
+def _parse_date(value: str) -> date:
+    value = value.strip()[:10]
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Неизвестный формат даты: {value}")
+
+def _parse_amount(value: str) -> float:
+    negative = '-' in value or '−' in value or (value.startswith('(') and value.endswith(')'))
+    value = re.sub(r'[^\d,.]', '', value)
+    if not value:
+        raise ValueError("Пустая сумма")
+    amount = parse_number(value)
+    return -amount if negative else amount
+
+def _cell(row: list[str], columns: dict, name: str) -> Optional[str]:
+    index = columns.get(name)
+    if index is None or index >= len(row):
+        return None
+    return row[index].strip() or None
+
+def _signed_amount(row: list[str], columns: dict) -> float:
+    if 'debit' not in columns:
+        return _parse_amount(_cell(row, columns, 'amount') or '')
+    debit = _cell(row, columns, 'debit')
+    if debit and _parse_amount(debit):
+        return -abs(_parse_amount(debit))
+    return abs(_parse_amount(_cell(row, columns, 'credit') or ''))
+
+def _parse_row(row: list[str], columns: dict, default_currency: str) -> list:
+    expense_date = _parse_date(_cell(row, columns, 'date') or '')
+    amount = _signed_amount(row, columns)
+    if amount == 0:
+        raise ValueError("Нулевая сумма")
+    
+    currency = _cell(row, columns, 'currency')
+    currency = normalize_currency(currency) if currency else default_currency
+    
+    category = _cell(row, columns, 'category')
+    category = category.lower() if category and category.lower() in EXPENSE_CATEGORIES else None
+    
+    return [expense_date, amount, currency, category, _cell(row, columns, 'description') or '']
+
+def _read_parsed(parsed):
+    parsed.seek(0)
+    for expense_date, amount, currency, category, description in csv.reader(parsed):
+        yield [date.fromisoformat(expense_date), float(amount), currency, category or None, description]
+
+def _categorize(rows: list[list], result: ImportResult):
+    unknown = []
+    for row in rows:
+        if row[3] is not None:
+            continue
+        row[3] = categorize_locally(row[4]) if row[4] else 'другие'
+        if row[3] is not None:
+            result.categorized_locally += 1
+        else:
+            unknown.append(row)
+    
+    for start in range(0, len(unknown), IMPORT_MODEL_BATCH_SIZE):
+        chunk = unknown[start:start + IMPORT_MODEL_BATCH_SIZE]
+        try:
+            categories = categorize_batch([row[4] for row in chunk])
+        except Exception as e:
+            logger.warning(f"Категории для {len(chunk)} строк не определены, они сохраняются как 'другие': {str(e)}")
+            categories = ['другие'] * len(chunk)
+            result.uncategorized += len(chunk)
+        else:
+            result.categorized_by_model += len(chunk)
+        for row, category in zip(chunk, categories):
+            row[3] = category
+
+def _stage_rows(writer, rows: list[list], user_id: int):
+    for expense_date, amount, currency, category, _ in rows:
+        writer.writerow([expense_date.isoformat(), amount, currency, category, user_id])
+
+def _copy_staged(staged):
+    staged.seek(0)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.copy_expert("""
+            COPY expenses (date, amount, currency, category, user_id)
+            FROM STDIN WITH (FORMAT csv)
+        """, staged)
+        conn.commit()
+
+def _open_text(stream) -> io.TextIOWrapper:
+    stream.seek(0)
+    sample = stream.read(64 * 1024)
+    stream.seek(0)
+    try:
+        sample.decode('utf-8')
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError as e:
+        encoding = 'utf-8-sig' if e.start > len(sample) - 4 else 'cp1251'
+    return io.TextIOWrapper(stream, encoding=encoding, errors='replace', newline='')
+
+def import_expenses_csv(stream, user_id: int, default_currency: str = 'ARS', progress=None) -> ImportResult:
+    text = _open_text(stream)
+    try:
+        sample = text.read(8192)
+        text.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        
+        reader = csv.reader(text, dialect)
+        header = next(reader, None)
+        if header is None:
+            raise CsvImportError("Файл пуст")
+        columns = _detect_columns(header)
+        
+        result = ImportResult()
+        logger.info(f"Импорт расходов для пользователя {user_id}, колонки: {columns}")
+        with tempfile.SpooledTemporaryFile(max_size=MEDIA_SPOOL_MEMORY_BYTES, mode='w+', newline='') as parsed, \
+             tempfile.SpooledTemporaryFile(max_size=MEDIA_SPOOL_MEMORY_BYTES, mode='w+', newline='') as staged:
+            parsed_writer = csv.writer(parsed)
+            signed = 'debit' in columns
+            for row in reader:
+                if not any(cell.strip() for cell in row):
+                    continue
+                try:
+                    expense = _parse_row(row, columns, default_currency)
+                except ValueError:
+                    result.skipped += 1
+                    continue
+                signed = signed or expense[1] < 0
+                parsed_writer.writerow([expense[0].isoformat(), *expense[1:]])
+            
+            writer = csv.writer(staged)
+            batch = []
+            for expense in _read_parsed(parsed):
+                if signed and expense[1] > 0:
+                    result.credits += 1
+                    continue
+                expense[1] = abs(expense[1])
+                batch.append(expense)
+                
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    _categorize(batch, result)
+                    _stage_rows(writer, batch, user_id)
+                    result.imported += len(batch)
+                    batch = []
+                    if progress:
+                        progress(result)
+            
+            if batch:
+                _categorize(batch, result)
+                _stage_rows(writer, batch, user_id)
+                result.imported += len(batch)
+            
+            if result.imported:
+                _copy_staged(staged)
+        
+        logger.info(f"Импорт для пользователя {user_id} завершен: {result}")
+        return result
+    finally:
+        text.detach()
@@ -0,0 +1,256 @@
+from psycopg2.extras import Json
+from typing import Optional
+import asyncio
+import logging
+
+from config import (
+    MEDIA_JOB_WORKERS,
+    MEDIA_JOB_MAX_ATTEMPTS,
+    MEDIA_JOB_LEASE,
+    MEDIA_JOB_POLL_INTERVAL,
+    MEDIA_JOB_RETRY_DELAY,
+    MEDIA_JOB_ATTACH_GRACE,
+    MEDIA_JOB_RETENTION,
+)
+from db import get_connection
+from executors import run_db
+
+logger = logging.getLogger(__name__)
+
+PURGE_CHECK_EVERY = 100
+
+JOB_FIELDS = ['id', 'kind', 'user_id', 'chat_id', 'source_message_id', 'reply_message_id', 'payload', 'attempts']
+
+class PermanentJobError(Exception):
+    pass
+
+def _row_to_job(row) -> dict:
+    return dict(zip(JOB_FIELDS, row))
+
+def enqueue_job(kind: str, user_id: int, chat_id: int, source_message_id: int, payload: dict) -> Optional[int]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO media_jobs (kind, user_id, chat_id, source_message_id, payload, run_after)
+            VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+            ON CONFLICT (chat_id, source_message_id) DO NOTHING
+            RETURNING id
+        """, (kind, user_id, chat_id, source_message_id, Json(payload), MEDIA_JOB_ATTACH_GRACE))
+        row = cursor.fetchone()
+        conn.commit()
+    if row is None:
+        logger.info(f"Задача для сообщения {source_message_id} в чате {chat_id} уже существует")
+        return None
+    logger.info(f"Поставлена задача {row[0]} ({kind}) для пользователя {user_id}")
+    return row[0]
+
+def attach_reply(job_id: int, reply_message_id: int):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE media_jobs
+            SET reply_message_id = %s, run_after = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND status = 'queued'
+        """, (reply_message_id, job_id))
+        conn.commit()
+
+def claim_job() -> Optional[dict]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            UPDATE media_jobs
+            SET status = 'running', attempts = attempts + 1,
+                locked_until = CURRENT_TIMESTAMP + make_interval(secs => %s), updated_at = CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM media_jobs
+                WHERE (status = 'queued' AND run_after <= CURRENT_TIMESTAMP)
+                   OR (status = 'running' AND locked_until < CURRENT_TIMESTAMP)
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING {', '.join(JOB_FIELDS)}
+        """, (MEDIA_JOB_LEASE,))
+        row = cursor.fetchone()
+        conn.commit()
+    return _row_to_job(row) if row else None
+
+def complete_job(job_id: int):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE media_jobs
+            SET status = 'done', locked_until = NULL, last_error = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        """, (job_id,))
+        conn.commit()
+
+def fail_job(job_id: int, error: str, retry_in: Optional[float]):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        if retry_in is None:
+            cursor.execute("""
+                UPDATE media_jobs
+                SET status = 'failed', locked_until = NULL, last_error = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (error, job_id))
+        else:
+            cursor.execute("""
+                UPDATE media_jobs
+                SET status = 'queued', locked_until = NULL, last_error = %s,
+                    run_after = CURRENT_TIMESTAMP + make_interval(secs => %s), updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (error, retry_in, job_id))
+        conn.commit()
+
+def release_job(job_id: int):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE media_jobs
+            SET status = 'queued', attempts = attempts - 1, locked_until = NULL,
+                run_after = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND status = 'running'
+        """, (job_id,))
+        conn.commit()
+
+def purge_finished_jobs() -> int:
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                DELETE FROM media_jobs
+                WHERE status IN ('done', 'failed')
+                  AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            """, (MEDIA_JOB_RETENTION,))
+            deleted = cursor.rowcount
+            conn.commit()
+    except Exception as e:
+        logger.warning(f"Ошибка при удалении завершенных задач: {str(e)}")
+        return 0
+    if deleted:
+        logger.info(f"Удалено завершенных задач: {deleted}")
+    return deleted
+
+def get_job_stats() -> dict:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT status, COUNT(*) FROM media_jobs GROUP BY status")
+        return dict(cursor.fetchall())
+
+async def job_reply(bot, job: dict, text: str, reply_markup=None):
+    if job.get('reply_message_id'):
+        await bot.edit_message_text(text, chat_id=job['chat_id'], message_id=job['reply_message_id'], reply_markup=reply_markup)
+    else:
+        message = await bot.send_message(
+            job['chat_id'], text,
+            reply_to_message_id=job['source_message_id'],
+            reply_markup=reply_markup
+        )
+        job['reply_message_id'] = message.message_id
+
+class JobRunner:
+    def __init__(self, workers: int, max_attempts: int, retry_delay: float, poll_interval: float):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self._handlers = {}
+        self._tasks = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._finished_since_purge = 0
+
+    def register(self, kind: str, handler):
+        self._handlers[kind] = handler
+
+    def start(self, bot):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work(bot, index)) for index in range(self.workers)]
+        logger.info(f"Запущено обработчиков задач: {self.workers}")
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _wait(self):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _work(self, bot, index: int):
+        while True:
+            try:
+                job = await run_db(claim_job)
+            except Exception as e:
+                logger.error(f"Ошибка при получении задачи: {str(e)}", exc_info=True)
+                job = None
+
+            if job is None:
+                await self._wait()
+                continue
+            await self._run(bot, job)
+
+    async def _run(self, bot, job: dict):
+        if job['attempts'] > self.max_attempts:
+            logger.error(f"Задача {job['id']} прерывалась {self.max_attempts} раз подряд и больше не запускается")
+            await run_db(fail_job, job['id'], "Обработчик прерывался при каждой попытке", None)
+            try:
+                await job_reply(bot, job, "Не удалось обработать сообщение. Попробуйте отправить его еще раз.")
+            except Exception as reply_error:
+                logger.warning(f"Не удалось отправить ответ по задаче {job['id']}: {str(reply_error)}")
+            return
+
+        handler = self._handlers.get(job['kind'])
+        logger.info(f"Задача {job['id']} ({job['kind']}), попытка {job['attempts']}")
+        try:
+            if handler is None:
+                raise PermanentJobError(f"Неизвестный тип задачи: {job['kind']}")
+            await handler(bot, job)
+            await run_db(complete_job, job['id'])
+        except asyncio.CancelledError:
+            logger.info(f"Задача {job['id']} прервана остановкой бота и возвращена в очередь")
+            await asyncio.shield(run_db(release_job, job['id']))
+            raise
+        except Exception as e:
+            permanent = isinstance(e, PermanentJobError) or job['attempts'] >= self.max_attempts
+            retry_in = None if permanent else self.retry_delay * 2 ** (job['attempts'] - 1)
+            logger.error(f"Ошибка в задаче {job['id']} (попытка {job['attempts']}): {str(e)}", exc_info=not permanent)
+            await run_db(fail_job, job['id'], str(e), retry_in)
+            try:
+                if isinstance(e, PermanentJobError):
+                    await job_reply(bot, job, f"Не удалось обработать сообщение: {str(e)}")
+                elif permanent:
+                    await job_reply(bot, job, "Не удалось обработать сообщение. Попробуйте отправить его еще раз.")
+                else:
+                    await job_reply(bot, job, f"Ошибка при обработке, повторю через {retry_in:.0f} с...")
+            except Exception as reply_error:
+                logger.warning(f"Не удалось отправить ответ по задаче {job['id']}: {str(reply_error)}")
+
+        self._finished_since_purge += 1
+        if self._finished_since_purge >= PURGE_CHECK_EVERY:
+            self._finished_since_purge = 0
+            await run_db(purge_finished_jobs)
+
+job_runner = JobRunner(MEDIA_JOB_WORKERS, MEDIA_JOB_MAX_ATTEMPTS, MEDIA_JOB_RETRY_DELAY, MEDIA_JOB_POLL_INTERVAL)
+
+def register_job_handler(kind: str, handler):
+    job_runner.register(kind, handler)
+
+def start_job_runner(bot):
+    job_runner.start(bot)
+
+def wake_job_runner():
+    job_runner.wake()
+
+async def stop_job_runner():
+    await job_runner.stop()
@@ -0,0 +1,83 @@
+from typing import Optional
+import base64
+import httpx
+import logging
+import shutil
+import tempfile
+import urllib.parse
+
+from config import MEDIA_MAX_BYTES, MEDIA_SPOOL_MEMORY_BYTES
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+_client: Optional[httpx.AsyncClient] = None
+
+class MediaTooLargeError(Exception):
+    pass
+
+class MediaDownloadError(Exception):
+    pass
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=10.0))
+    return _client
+
+async def close_media_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+async def download_media(bot, file_id: str, file_size: Optional[int] = None):
+    if file_size and file_size > MEDIA_MAX_BYTES:
+        raise MediaTooLargeError(f"Файл размером {file_size} байт превышает лимит {MEDIA_MAX_BYTES} байт")
+    
+    tg_file = await bot.get_file(file_id)
+    out = tempfile.SpooledTemporaryFile(max_size=MEDIA_SPOOL_MEMORY_BYTES)
+    written = 0
+    try:
+        if not tg_file.file_path.startswith(('http://', 'https://')):
+            with open(tg_file.file_path, 'rb') as f:
+                shutil.copyfileobj(f, out, CHUNK_SIZE)
+            written = out.tell()
+        else:
+            parts = urllib.parse.urlsplit(tg_file.file_path)
+            url = urllib.parse.urlunsplit(parts._replace(path=urllib.parse.quote(parts.path)))
+            try:
+                async with _get_client().stream('GET', url) as response:
+                    if response.is_error:
+                        raise MediaDownloadError(f"Не удалось загрузить файл: HTTP {response.status_code}")
+                    async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                        written += len(chunk)
+                        if written > MEDIA_MAX_BYTES:
+                            raise MediaTooLargeError(f"Файл превышает лимит {MEDIA_MAX_BYTES} байт")
+                        out.write(chunk)
+            except httpx.HTTPError as e:
+                raise MediaDownloadError(f"Не удалось загрузить файл: {type(e).__name__}") from None
+        if written > MEDIA_MAX_BYTES:
+            raise MediaTooLargeError(f"Файл превышает лимит {MEDIA_MAX_BYTES} байт")
+    except Exception:
+        out.close()
+        raise
+    
+    out.seek(0)
+    logger.info(f"Файл загружен: {written} байт")
+    return out
+
+def stream_size(stream) -> int:
+    position = stream.tell()
+    stream.seek(0, 2)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+def encode_data_url(stream, mime_type: str) -> str:
+    stream.seek(0)
+    parts = [f"data:{mime_type};base64,"]
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE * 3), b''):
+        parts.append(base64.b64encode(chunk).decode('ascii'))
+    return ''.join(parts)
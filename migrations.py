@@ -0,0 +1,290 @@
+import logging
+
+from db import get_connection
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_LOCK_ID = 72817301
+
+MIGRATIONS = [
+    {
+        'version': 1,
+        'name': 'Таблица expenses',
+        'statements': [
+            """
+            CREATE TABLE IF NOT EXISTS expenses (
+                id SERIAL PRIMARY KEY,
+                date DATE NOT NULL,
+                amount REAL NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            "ALTER TABLE expenses ADD COLUMN IF NOT EXISTS currency TEXT DEFAULT 'RUB'",
+            "ALTER TABLE expenses ADD COLUMN IF NOT EXISTS category TEXT DEFAULT 'другие'",
+            "ALTER TABLE expenses ADD COLUMN IF NOT EXISTS user_id INTEGER NOT NULL DEFAULT 0",
+        ],
+    },
+    {
+        'version': 2,
+        'name': 'Таблица user_settings',
+        'statements': [
+            """
+            CREATE TABLE IF NOT EXISTS user_settings (
+                user_id INTEGER PRIMARY KEY,
+                display_currency TEXT DEFAULT 'ARS',
+                usd_to_ars_rate REAL DEFAULT NULL,
+                rub_to_ars_rate REAL DEFAULT NULL
+            )
+            """,
+        ],
+    },
+    {
+        'version': 3,
+        'name': 'Индекс expenses (user_id, date)',
+        'transactional': False,
+        'statements': [
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_expenses_user_date ON expenses (user_id, date)",
+        ],
+    },
+    {
+        'version': 4,
+        'name': 'Индекс expenses для сводов по категориям',
+        'transactional': False,
+        'statements': [
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_expenses_user_category_date
+            ON expenses (user_id, category, date) INCLUDE (currency, amount)
+            """,
+        ],
+    },
+    {
+        'version': 5,
+        'name': 'Снимок курсов валют',
+        'statements': [
+            """
+            CREATE TABLE IF NOT EXISTS exchange_rate_snapshot (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                rates JSONB NOT NULL,
+                fetched_at TIMESTAMPTZ NOT NULL,
+                source TEXT NOT NULL
+            )
+            """,
+        ],
+    },
+    {
+        'version': 6,
+        'name': 'История курсов валют по дням',
+        'statements': [
+            """
+            CREATE TABLE IF NOT EXISTS exchange_rates_history (
+                currency TEXT NOT NULL,
+                rate_date DATE NOT NULL,
+                per_usd DOUBLE PRECISION NOT NULL,
+                PRIMARY KEY (currency, rate_date)
+            )
+            """,
+        ],
+    },
+    {
+        'version': 7,
+        'name': 'Кэш результатов модели',
+        'statements': [
+            """
+            CREATE TABLE IF NOT EXISTS model_cache (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                value JSONB NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_model_cache_last_used_at ON model_cache (last_used_at)",
+        ],
+    },
+    {
+        'version': 8,
+        'name': 'Дневные итоги daily_totals',
+        'statements': [
+            "LOCK TABLE expenses IN SHARE ROW EXCLUSIVE MODE",
+            """
+            CREATE TABLE IF NOT EXISTS daily_totals (
+                user_id INTEGER NOT NULL,
+                date DATE NOT NULL,
+                category TEXT NOT NULL,
+                currency TEXT NOT NULL,
+                sum DOUBLE PRECISION NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (user_id, date, category, currency)
+            )
+            """,
+            """
+            CREATE OR REPLACE FUNCTION daily_totals_apply() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                    WITH removed AS (
+                        SELECT user_id, date, COALESCE(category, 'другие') AS category,
+                               COALESCE(currency, 'RUB') AS currency, SUM(amount) AS sum, COUNT(*) AS count
+                        FROM old_rows
+                        GROUP BY 1, 2, 3, 4
+                    )
+                    UPDATE daily_totals t
+                    SET sum = t.sum - removed.sum, count = t.count - removed.count
+                    FROM removed
+                    WHERE t.user_id = removed.user_id AND t.date = removed.date
+                      AND t.category = removed.category AND t.currency = removed.currency;
+                END IF;
+                
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO daily_totals (user_id, date, category, currency, sum, count)
+                    SELECT user_id, date, COALESCE(category, 'другие'), COALESCE(currency, 'RUB'), SUM(amount), COUNT(*)
+                    FROM new_rows
+                    GROUP BY 1, 2, 3, 4
+                    ON CONFLICT (user_id, date, category, currency) DO UPDATE
+                    SET sum = daily_totals.sum + EXCLUDED.sum, count = daily_totals.count + EXCLUDED.count;
+                END IF;
+                
+                IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                    DELETE FROM daily_totals t
+                    USING (SELECT DISTINCT user_id, date FROM old_rows) o
+                    WHERE t.user_id = o.user_id AND t.date = o.date AND t.count <= 0;
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            "DROP TRIGGER IF EXISTS expenses_daily_totals_insert ON expenses",
+            "DROP TRIGGER IF EXISTS expenses_daily_totals_update ON expenses",
+            "DROP TRIGGER IF EXISTS expenses_daily_totals_delete ON expenses",
+            """
+            CREATE TRIGGER expenses_daily_totals_insert
+            AFTER INSERT ON expenses REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION daily_totals_apply()
+            """,
+            """
+            CREATE TRIGGER expenses_daily_totals_update
+            AFTER UPDATE ON expenses REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION daily_totals_apply()
+            """,
+            """
+            CREATE TRIGGER expenses_daily_totals_delete
+            AFTER DELETE ON expenses REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION daily_totals_apply()
+            """,
+            "TRUNCATE daily_totals",
+            """
+            INSERT INTO daily_totals (user_id, date, category, currency, sum, count)
+            SELECT user_id, date, COALESCE(category, 'другие'), COALESCE(currency, 'RUB'), SUM(amount), COUNT(*)
+            FROM expenses
+            GROUP BY 1, 2, 3, 4
+            """,
+        ],
+    },
+    {
+        'version': 9,
+        'name': 'Неподтвержденные расходы',
+        'statements': [
+            """
+            CREATE TABLE IF NOT EXISTS pending_expenses (
+                id BIGSERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                expenses JSONB NOT NULL,
+                source_type TEXT NOT NULL,
+                source_data JSONB NOT NULL DEFAULT '{}',
+                created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMPTZ NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_pending_expenses_expires_at ON pending_expenses (expires_at)",
+        ],
+    },
+    {
+        'version': 10,
+        'name': 'Очередь задач обработки голосовых и фото',
+        'statements': [
+            """
+            CREATE TABLE IF NOT EXISTS media_jobs (
+                id BIGSERIAL PRIMARY KEY,
+                kind TEXT NOT NULL,
+                user_id BIGINT NOT NULL,
+                chat_id BIGINT NOT NULL,
+                source_message_id BIGINT NOT NULL,
+                reply_message_id BIGINT,
+                payload JSONB NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                run_after TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                locked_until TIMESTAMPTZ,
+                last_error TEXT,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (chat_id, source_message_id)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_media_jobs_queued ON media_jobs (run_after) WHERE status = 'queued'",
+            "CREATE INDEX IF NOT EXISTS idx_media_jobs_running ON media_jobs (locked_until) WHERE status = 'running'",
+            "CREATE INDEX IF NOT EXISTS idx_media_jobs_finished ON media_jobs (updated_at) WHERE status IN ('done', 'failed')",
+        ],
+    },
+]
+
+def _ensure_migrations_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def _apply_migration(cursor, migration: dict):
+    transactional = migration.get('transactional', True)
+    logger.info(f"Применение миграции {migration['version']}: {migration['name']}")
+    if transactional:
+        cursor.execute("BEGIN")
+    try:
+        for statement in migration['statements']:
+            cursor.execute(statement)
+        cursor.execute(
+            "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+            (migration['version'], migration['name'])
+        )
+        if transactional:
+            cursor.execute("COMMIT")
+    except Exception:
+        if transactional:
+            cursor.execute("ROLLBACK")
+        raise
+
+def get_schema_version() -> int:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT to_regclass('schema_migrations')")
+        if cursor.fetchone()[0] is None:
+            return 0
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+        return cursor.fetchone()[0]
+
+def run_migrations():
+    with get_connection() as conn:
+        previous_autocommit = conn.autocommit
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+        try:
+            _ensure_migrations_table(cursor)
+            cursor.execute("SELECT version FROM schema_migrations")
+            applied = {row[0] for row in cursor.fetchall()}
+            
+            pending = [m for m in sorted(MIGRATIONS, key=lambda m: m['version']) if m['version'] not in applied]
+            if not pending:
+                logger.info("Схема базы данных актуальна")
+            for migration in pending:
+                try:
+                    _apply_migration(cursor, migration)
+                except Exception as e:
+                    logger.error(f"Ошибка при применении миграции {migration['version']}: {str(e)}", exc_info=True)
+                    raise
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+            cursor.close()
+            conn.autocommit = previous_autocommit
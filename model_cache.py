@@ -0,0 +1,152 @@
+from collections import OrderedDict
+from psycopg2.extras import Json
+import hashlib
+import logging
+import threading
+
+from config import MODEL_CACHE_ENABLED, MODEL_CACHE_MEMORY_SIZE, MODEL_CACHE_MAX_ENTRIES
+from db import get_connection
+
+logger = logging.getLogger(__name__)
+
+EVICTION_CHECK_EVERY = 100
+
+class ModelCache:
+    def __init__(self, memory_size: int, max_entries: int):
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_eviction = 0
+        self._stats = {}
+    
+    def _count(self, kind: str, event: str):
+        with self._lock:
+            kind_stats = self._stats.setdefault(kind, {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'stores': 0})
+            kind_stats[event] += 1
+    
+    def _remember(self, key: str, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+    
+    def get(self, kind: str, key: str):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                value = self._memory[key]
+            else:
+                value = None
+        if value is not None:
+            self._count(kind, 'memory_hits')
+            return value
+        
+        try:
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE model_cache SET last_used_at = CURRENT_TIMESTAMP
+                    WHERE key = %s
+                    RETURNING value
+                """, (key,))
+                row = cursor.fetchone()
+                conn.commit()
+        except Exception as e:
+            logger.warning(f"Ошибка при чтении кэша результатов модели: {str(e)}")
+            row = None
+        
+        if row is None:
+            self._count(kind, 'misses')
+            return None
+        
+        self._count(kind, 'db_hits')
+        self._remember(key, row[0])
+        return row[0]
+    
+    def put(self, kind: str, key: str, value):
+        self._remember(key, value)
+        self._count(kind, 'stores')
+        try:
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO model_cache (key, kind, value)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, last_used_at = CURRENT_TIMESTAMP
+                """, (key, kind, Json(value)))
+                conn.commit()
+        except Exception as e:
+            logger.warning(f"Ошибка при записи в кэш результатов модели: {str(e)}")
+            return
+        
+        with self._lock:
+            self._writes_since_eviction += 1
+            evict = self._writes_since_eviction >= EVICTION_CHECK_EVERY
+            if evict:
+                self._writes_since_eviction = 0
+        if evict:
+            self.evict()
+    
+    def evict(self):
+        try:
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    DELETE FROM model_cache
+                    WHERE key IN (
+                        SELECT key FROM model_cache
+                        ORDER BY last_used_at DESC
+                        OFFSET %s
+                    )
+                """, (self.max_entries,))
+                deleted = cursor.rowcount
+                conn.commit()
+        except Exception as e:
+            logger.warning(f"Ошибка при очистке кэша результатов модели: {str(e)}")
+            return
+        if deleted:
+            logger.info(f"Из кэша результатов модели удалено записей: {deleted}")
+    
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {kind: dict(values) for kind, values in self._stats.items()}
+            stats['memory_entries'] = len(self._memory)
+        return stats
+
+model_cache = ModelCache(MODEL_CACHE_MEMORY_SIZE, MODEL_CACHE_MAX_ENTRIES)
+
+def normalize_text(text: str) -> str:
+    return ' '.join(text.lower().split())
+
+def make_key(kind: str, model: str, prompt_version: int, digest: str) -> str:
+    return f"{kind}:{model}:v{prompt_version}:{digest}"
+
+def digest_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def digest_text(text: str) -> str:
+    return digest_bytes(normalize_text(text).encode('utf-8'))
+
+def digest_stream(stream, chunk_size: int = 64 * 1024) -> str:
+    stream.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+def cached_call(kind: str, key: str, compute):
+    if not MODEL_CACHE_ENABLED:
+        return compute()
+    value = model_cache.get(kind, key)
+    if value is not None:
+        logger.info(f"Результат {kind} взят из кэша")
+        return value
+    value = compute()
+    model_cache.put(kind, key, value)
+    return value
+
+def get_cache_stats() -> dict:
+    return model_cache.stats()
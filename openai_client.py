@@ -1,31 +1,131 @@
 from openai import OpenAI
 from config import OPENAI_API_KEY
+from dataclasses import dataclass
 import io
+import json
 import logging
 
+from model_cache import cached_call, make_key, digest_text, digest_bytes, digest_stream
+from openai_scheduler import scheduler, estimate_tokens
+
 logger = logging.getLogger(__name__)
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+
+IMAGE_TOKEN_ESTIMATE = 1105
+
+PROMPT_VERSIONS = {
+    'transcription': 1,
+    'ocr': 1,
+    'expenses': 1,
+    'categories': 1,
+}
+
+EXPENSE_CATEGORIES = ['еда', 'транспорт', 'развлечения', 'коммунальные', 'одежда', 'здоровье', 'другие']
+
+EXPENSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "amount": {
+            "type": "number",
+            "description": "Сумма расхода числом. 0, если суммы в тексте нет."
+        },
+        "currency": {
+            "type": "string",
+            "description": "Код валюты ISO 4217: ARS, USD, RUB, EUR и т.д. ARS, если валюта не указана."
+        },
+        "category": {
+            "type": "string",
+            "enum": EXPENSE_CATEGORIES
+        }
+    },
+    "required": ["amount", "currency", "category"],
+    "additionalProperties": False
+}
+
+EXPENSE_LIST_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "items": {
+            "type": "array",
+            "items": EXPENSE_SCHEMA
+        }
+    },
+    "required": ["items"],
+    "additionalProperties": False
+}
+
+CATEGORY_LIST_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "categories": {
+            "type": "array",
+            "items": {"type": "string", "enum": EXPENSE_CATEGORIES}
+        }
+    },
+    "required": ["categories"],
+    "additionalProperties": False
+}
 
-def transcribe_audio(audio_file) -> str:
-    logger.info("Запрос транскрипции аудио через Whisper")
+@dataclass(frozen=True)
+class ExpenseExtraction:
+    amount: float
+    currency: str
+    category: str
+
+CURRENCY_ALIASES = {
+    'RUB': ['RUB', 'РУБ', 'РУБЛЕЙ', 'РУБЛЯ', 'РУБЛЬ', '₽'],
+    'ARS': ['ARS', 'ПЕСО'],
+    'USD': ['USD', 'ДОЛЛАР', 'ДОЛЛАРОВ', 'ДОЛЛАРА', '$'],
+}
+
+def normalize_currency(currency: str) -> str:
+    currency = currency.strip().upper()
+    for code, aliases in CURRENCY_ALIASES.items():
+        if currency in aliases:
+            return code
+    return currency[:3].upper()
+
+def normalize_category(category: str) -> str:
+    category = category.strip().lower()
+    if category in EXPENSE_CATEGORIES:
+        return category
+    logger.warning(f"Получена недопустимая категория: {category}, используется 'другие'")
+    return 'другие'
+
+def transcribe_audio(audio_file, filename: str = "voice.ogg") -> str:
     if hasattr(audio_file, 'seek'):
-        audio_file.seek(0)
-    try:
-        transcript = client.audio.transcriptions.create(
-            model="whisper-1",
-            file=audio_file
-        )
+        key = make_key('transcription', "whisper-1", PROMPT_VERSIONS['transcription'], digest_stream(audio_file))
+    else:
+        key = make_key('transcription', "whisper-1", PROMPT_VERSIONS['transcription'], digest_bytes(audio_file))
+    
+    def request():
+        logger.info("Запрос транскрипции аудио через Whisper")
+        
+        def call(timeout):
+            if hasattr(audio_file, 'seek'):
+                audio_file.seek(0)
+            return client.with_options(timeout=timeout).audio.transcriptions.create(
+                model="whisper-1",
+                file=(filename, audio_file)
+            )
+        
+        transcript = scheduler.run(key, call)
         logger.info(f"Транскрипция успешно получена: {transcript.text[:100]}")
         return transcript.text
+    
+    try:
+        return cached_call('transcription', key, request)
     except Exception as e:
         logger.error(f"Ошибка при транскрипции аудио: {str(e)}", exc_info=True)
         raise
 
-def extract_text_from_image(image_base64: str) -> str:
-    logger.info("Запрос извлечения текста из изображения через GPT-4 Vision")
-    try:
-        response = client.chat.completions.create(
+def extract_text_from_image(image_url: str, image_digest: str) -> str:
+    key = make_key('ocr', "gpt-4o", PROMPT_VERSIONS['ocr'], image_digest)
+    
+    def request():
+        logger.info("Запрос извлечения текста из изображения через GPT-4 Vision")
+        response = scheduler.run(key, lambda timeout: client.with_options(timeout=timeout).chat.completions.create(
             model="gpt-4o",
             messages=[
                 {
@@ -38,103 +138,108 @@ def extract_text_from_image(image_base64: str) -> str:
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": image_url
                             }
                         }
                     ]
                 }
             ],
             max_tokens=300
-        )
+        ), estimate_tokens(max_tokens=IMAGE_TOKEN_ESTIMATE + 300))
         text = response.choices[0].message.content
         logger.info(f"Текст из изображения успешно извлечен: {text[:100]}")
         return text
+    
+    try:
+        return cached_call('ocr', key, request)
     except Exception as e:
         logger.error(f"Ошибка при извлечении текста из изображения: {str(e)}", exc_info=True)
         raise
 
-def determine_expense_category(text: str) -> str:
-    logger.info(f"Запрос определения категории из текста: {text[:100]}")
-    prompt = f"""Определи категорию расхода на основе следующего текста.
-Доступные категории: еда, транспорт, развлечения, коммунальные, одежда, здоровье, другие.
-Верни только одно слово - название категории на русском языке.
-Если категорию определить сложно, используй "другие".
-
-Текст: {text}
-Категория:"""
-
-    try:
-        response = client.chat.completions.create(
+def extract_expenses_structured(text: str) -> list[ExpenseExtraction]:
+    key = make_key('expenses', "gpt-4o", PROMPT_VERSIONS['expenses'], digest_text(text))
+    
+    def request():
+        logger.info(f"Запрос извлечения списка расходов из текста: {text[:100]}")
+        response = scheduler.run(key, lambda timeout: client.with_options(timeout=timeout).chat.completions.create(
             model="gpt-4o",
             messages=[
-                {"role": "system", "content": "Ты помощник для определения категорий расходов. Определяй категорию на основе текста. Всегда возвращай только одно слово из списка: еда, транспорт, развлечения, коммунальные, одежда, здоровье, другие."},
-                {"role": "user", "content": prompt}
+                {"role": "system", "content": "Ты помощник для учета расходов. Извлеки из текста все расходы: для каждого сумму, валюту и категорию. "
+                                              "Если в тексте перечислено несколько покупок, верни каждую отдельным элементом. "
+                                              "Если это чек магазина, объедини позиции по категориям, чтобы сумма элементов совпадала с итогом чека, и не добавляй итог отдельным элементом. "
+                                              "Понимай словесные формы чисел: \"15 тысяч\" = 15000, \"тыс\" = умножить на 1000. "
+                                              "Если валюта не указана, используй ARS (песо). Если расходов нет, верни пустой список. "
+                                              "Если категорию определить сложно, используй \"другие\"."},
+                {"role": "user", "content": text}
             ],
-            max_tokens=20,
+            response_format={
+                "type": "json_schema",
+                "json_schema": {"name": "expenses", "strict": True, "schema": EXPENSE_LIST_SCHEMA}
+            },
+            max_tokens=600,
             temperature=0
-        )
+        ), estimate_tokens(text, max_tokens=600))
         
-        category = response.choices[0].message.content.strip().lower()
-        valid_categories = ['еда', 'транспорт', 'развлечения', 'коммунальные', 'одежда', 'здоровье', 'другие']
+        result = response.choices[0].message.content
+        try:
+            items = []
+            for data in json.loads(result)['items']:
+                amount = float(data['amount'])
+                if amount <= 0:
+                    continue
+                items.append({
+                    'amount': amount,
+                    'currency': normalize_currency(str(data['currency'])) or 'ARS',
+                    'category': normalize_category(str(data['category']))
+                })
+        except (ValueError, TypeError, KeyError):
+            raise ValueError(f"Не удалось разобрать результат: {result}")
         
-        if category in valid_categories:
-            logger.info(f"Категория успешно определена: {category}")
-            return category
-        else:
-            logger.warning(f"Получена недопустимая категория: {category}, используется 'другие'")
-            return 'другие'
+        logger.info(f"Извлечено расходов: {len(items)}")
+        return items
+    
+    try:
+        return [ExpenseExtraction(**item) for item in cached_call('expenses', key, request)]
+    except ValueError as e:
+        logger.warning(str(e))
+        return []
     except Exception as e:
-        logger.error(f"Ошибка при определении категории: {str(e)}", exc_info=True)
-        return 'другие'
-
-def parse_expense_from_text(text: str) -> tuple[float, str]:
-    logger.info(f"Запрос парсинга суммы из текста: {text[:100]}")
-    prompt = f"""Извлеки сумму расхода и валюту из следующего текста. 
-Сумма может быть указана в любой валюте (рубли, песо, доллары, USD, ARS и т.д.).
-Понимай словесные формы чисел: "15 тысяч" = 15000, "тысяч" = умножить на 1000, "тыс" = умножить на 1000.
-Верни результат в формате: СУММА|ВАЛЮТА
-Например: 15000|ARS или 500|руб или 100|USD
-Если валюты нет в тексте, используй "ARS" (песо).
-Если суммы нет, верни 0|ARS.
-
-Текст: {text}
-Результат:"""
+        logger.error(f"Ошибка при извлечении списка расходов из текста: {str(e)}", exc_info=True)
+        return []
 
-    try:
-        response = client.chat.completions.create(
+def categorize_batch(texts: list[str]) -> list[str]:
+    numbered = "\n".join(f"{i}. {text}" for i, text in enumerate(texts, 1))
+    key = make_key('categories', "gpt-4o", PROMPT_VERSIONS['categories'], digest_text(numbered))
+    
+    def request():
+        logger.info(f"Запрос определения категорий для {len(texts)} расходов")
+        response = scheduler.run(key, lambda timeout: client.with_options(timeout=timeout).chat.completions.create(
             model="gpt-4o",
             messages=[
-                {"role": "system", "content": "Ты помощник для извлечения сумм расходов из текста. Извлекай сумму и валюту. Всегда возвращай в формате: СУММА|ВАЛЮТА (например: 15000|ARS или 500|руб). Если валюта не указана, используй ARS (песо) по умолчанию."},
-                {"role": "user", "content": prompt}
+                {"role": "system", "content": "Ты помощник для определения категорий расходов. Для каждой пронумерованной строки определи категорию "
+                                              "из списка: еда, транспорт, развлечения, коммунальные, одежда, здоровье, другие. "
+                                              "Верни категории в том же порядке, по одной на строку. Если категорию определить сложно, используй \"другие\"."},
+                {"role": "user", "content": numbered}
             ],
-            max_tokens=50,
+            response_format={
+                "type": "json_schema",
+                "json_schema": {"name": "categories", "strict": True, "schema": CATEGORY_LIST_SCHEMA}
+            },
+            max_tokens=10 * len(texts) + 20,
             temperature=0
-        )
+        ), estimate_tokens(numbered, max_tokens=10 * len(texts) + 20))
         
-        result = response.choices[0].message.content.strip()
+        result = response.choices[0].message.content
         try:
-            if '|' in result:
-                amount_str, currency = result.split('|', 1)
-                amount = float(amount_str.strip())
-                currency = currency.strip().upper()
-                if currency in ['RUB', 'РУБ', 'РУБЛЕЙ', 'РУБЛЯ', 'РУБЛЬ']:
-                    currency = 'RUB'
-                elif currency in ['ARS', 'ПЕСО']:
-                    currency = 'ARS'
-                elif currency in ['USD', 'ДОЛЛАР', 'ДОЛЛАРОВ', 'ДОЛЛАРА', '$']:
-                    currency = 'USD'
-                else:
-                    currency = currency[:3].upper()
-                logger.info(f"Сумма и валюта успешно извлечены: {amount} {currency}")
-                return (max(0, amount), currency)
-            else:
-                amount = float(result)
-                logger.warning(f"Валюту не удалось извлечь, используется ARS по умолчанию")
-                return (max(0, amount), 'ARS')
-        except ValueError:
-            logger.warning(f"Не удалось преобразовать результат: {result}")
-            return (0.0, 'ARS')
+            categories = [normalize_category(str(category)) for category in json.loads(result)['categories']]
+        except (ValueError, TypeError, KeyError):
+            raise ValueError(f"Не удалось разобрать результат: {result}")
+        if len(categories) != len(texts):
+            raise ValueError(f"Получено {len(categories)} категорий вместо {len(texts)}")
+        return categories
+    
+    try:
+        return cached_call('categories', key, request)
     except Exception as e:
-        logger.error(f"Ошибка при парсинге суммы из текста: {str(e)}", exc_info=True)
-        return (0.0, 'ARS')
-
+        logger.error(f"Ошибка при определении категорий: {str(e)}", exc_info=True)
+        raise
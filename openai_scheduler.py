@@ -0,0 +1,169 @@
+from concurrent.futures import Future
+from contextvars import ContextVar
+from typing import Optional
+import openai
+import logging
+import random
+import threading
+import time
+
+from config import (
+    OPENAI_MAX_CONCURRENCY,
+    OPENAI_MAX_CONCURRENCY_PER_USER,
+    OPENAI_RPM,
+    OPENAI_TPM,
+    OPENAI_MAX_RETRIES,
+    OPENAI_BACKOFF_BASE,
+    OPENAI_BACKOFF_MAX,
+    OPENAI_REQUEST_DEADLINE,
+)
+
+logger = logging.getLogger(__name__)
+
+current_user_id: ContextVar[Optional[int]] = ContextVar('current_user_id', default=None)
+request_deadline: ContextVar[Optional[float]] = ContextVar('request_deadline', default=None)
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+def begin_request(user_id: int, timeout: float = OPENAI_REQUEST_DEADLINE):
+    current_user_id.set(user_id)
+    request_deadline.set(time.monotonic() + timeout)
+
+def remaining_time() -> float:
+    deadline = request_deadline.get()
+    if deadline is None:
+        return OPENAI_REQUEST_DEADLINE
+    return deadline - time.monotonic()
+
+class TokenBucket:
+    def __init__(self, capacity: float, per_minute: float):
+        self.capacity = capacity
+        self.rate = per_minute / 60.0
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self, amount: float, deadline: float):
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            if now + wait > deadline:
+                raise TimeoutError("Превышен лимит запросов к OpenAI, истекло время ожидания")
+            time.sleep(min(wait, 1.0))
+
+class OpenAIScheduler:
+    def __init__(self):
+        self._global = threading.BoundedSemaphore(OPENAI_MAX_CONCURRENCY)
+        self._per_user = {}
+        self._per_user_lock = threading.Lock()
+        self._requests = TokenBucket(OPENAI_RPM, OPENAI_RPM)
+        self._tokens = TokenBucket(OPENAI_TPM, OPENAI_TPM)
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+    
+    def _user_slot(self, user_id: Optional[int]):
+        with self._per_user_lock:
+            slot = self._per_user.get(user_id)
+            if slot is None:
+                slot = [threading.BoundedSemaphore(OPENAI_MAX_CONCURRENCY_PER_USER), 0]
+                self._per_user[user_id] = slot
+            slot[1] += 1
+            return slot
+    
+    def _release_user_slot(self, user_id: Optional[int], slot):
+        with self._per_user_lock:
+            slot[1] -= 1
+            if slot[1] == 0:
+                self._per_user.pop(user_id, None)
+    
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        retry_after = None
+        response = getattr(error, 'response', None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get('retry-after'))
+            except (TypeError, ValueError):
+                retry_after = None
+        cap = min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * (2 ** attempt))
+        delay = random.uniform(cap / 2, cap)
+        return max(delay, retry_after or 0)
+    
+    def _attempt(self, call, slot, user_id: Optional[int], deadline: float):
+        if not slot[0].acquire(timeout=max(0, deadline - time.monotonic())):
+            raise TimeoutError(f"Истекло время ожидания очереди запросов пользователя {user_id}")
+        try:
+            if not self._global.acquire(timeout=max(0, deadline - time.monotonic())):
+                raise TimeoutError("Истекло время ожидания свободного слота для запроса к OpenAI")
+            try:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    raise TimeoutError("Истекло время ожидания ответа OpenAI")
+                return call(timeout)
+            finally:
+                self._global.release()
+        finally:
+            slot[0].release()
+    
+    def _execute(self, call, estimated_tokens: int):
+        user_id = current_user_id.get()
+        deadline = time.monotonic() + remaining_time()
+        slot = self._user_slot(user_id)
+        try:
+            attempt = 0
+            while True:
+                self._requests.acquire(1, deadline)
+                if estimated_tokens:
+                    self._tokens.acquire(estimated_tokens, deadline)
+                try:
+                    return self._attempt(call, slot, user_id, deadline)
+                except RETRYABLE_ERRORS as e:
+                    if attempt >= OPENAI_MAX_RETRIES:
+                        raise
+                    delay = self._backoff(attempt, e)
+                    if time.monotonic() + delay >= deadline:
+                        raise
+                    attempt += 1
+                    logger.warning(f"Ошибка OpenAI ({type(e).__name__}), повтор {attempt}/{OPENAI_MAX_RETRIES} через {delay:.1f} с")
+                    time.sleep(delay)
+        finally:
+            self._release_user_slot(user_id, slot)
+    
+    def run(self, key: str, call, estimated_tokens: int = 0):
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+        
+        if not owner:
+            logger.info("Ожидание результата такого же запроса к OpenAI, уже выполняющегося")
+            return future.result(timeout=max(0, remaining_time()))
+        
+        try:
+            result = self._execute(call, estimated_tokens)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+scheduler = OpenAIScheduler()
+
+def estimate_tokens(*texts: str, max_tokens: int = 0) -> int:
+    return sum(len(text) for text in texts) // 3 + max_tokens
@@ -0,0 +1,199 @@
+from psycopg2.extras import Json
+from typing import Optional
+import asyncio
+import logging
+import threading
+
+from config import (
+    PENDING_EXPENSE_TTL,
+    CONFIRM_BATCH_INTERVAL,
+    CONFIRM_BATCH_MAX_SIZE,
+    CONFIRM_BATCH_CONCURRENCY,
+    CONFIRM_BATCH_LOCK_TIMEOUT,
+)
+from db import get_connection
+from executors import run_db
+from storage import expense_rows, insert_expense_rows, get_conversion_context, get_today_total
+
+logger = logging.getLogger(__name__)
+
+PURGE_CHECK_EVERY = 100
+
+_writes_since_purge = 0
+_purge_lock = threading.Lock()
+
+def create_pending(user_id: int, expenses: list[dict], source_type: str, source_data: Optional[dict] = None) -> int:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO pending_expenses (user_id, expenses, source_type, source_data, expires_at)
+            VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+            RETURNING id
+        """, (user_id, Json(expenses), source_type, Json(source_data or {}), PENDING_EXPENSE_TTL))
+        pending_id = cursor.fetchone()[0]
+        conn.commit()
+    logger.info(f"Сохранен неподтвержденный расход {pending_id} пользователя {user_id}")
+    
+    global _writes_since_purge
+    with _purge_lock:
+        _writes_since_purge += 1
+        purge = _writes_since_purge >= PURGE_CHECK_EVERY
+        if purge:
+            _writes_since_purge = 0
+    if purge:
+        purge_expired()
+    return pending_id
+
+def confirm_pending_batch(requests: list[tuple[int, int]], lock_timeout: Optional[float] = None) -> dict:
+    for user_id in {user_id for _, user_id in requests}:
+        get_conversion_context(user_id)
+    
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        if lock_timeout is not None:
+            cursor.execute("SELECT set_config('lock_timeout', %s, true)", (f"{int(lock_timeout * 1000)}ms",))
+        cursor.execute("""
+            DELETE FROM pending_expenses p
+            USING unnest(%s::bigint[], %s::bigint[]) AS r (id, user_id)
+            WHERE p.id = r.id AND p.user_id = r.user_id AND p.expires_at > CURRENT_TIMESTAMP
+            RETURNING p.id, p.user_id, p.expenses
+        """, ([pending_id for pending_id, _ in requests], [user_id for _, user_id in requests]))
+        confirmed = cursor.fetchall()
+        if not confirmed:
+            conn.rollback()
+            return {}
+        
+        rows = []
+        for _, user_id, expenses in confirmed:
+            rows.extend(expense_rows(expenses, user_id))
+        insert_expense_rows(cursor, rows)
+        
+        today_totals = {user_id: get_today_total(user_id, cursor) for user_id in {row[1] for row in confirmed}}
+        conn.commit()
+    
+    logger.info(f"Подтверждено {len(confirmed)} расходов из {len(requests)} запросов, сохранено строк: {len(rows)}")
+    return {
+        (pending_id, user_id): (expenses, today_totals[user_id])
+        for pending_id, user_id, expenses in confirmed
+    }
+
+class ConfirmationBatcher:
+    def __init__(self, interval: float, max_size: int, concurrency: int, lock_timeout: float):
+        self.interval = interval
+        self.max_size = max_size
+        self.lock_timeout = lock_timeout
+        self._slots = asyncio.Semaphore(concurrency)
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flushes = set()
+    
+    async def confirm(self, pending_id: int, user_id: int) -> Optional[tuple[list[dict], dict]]:
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((pending_id, user_id, future))
+        return await future
+    
+    async def _collect(self, first) -> tuple[list, bool]:
+        loop = asyncio.get_running_loop()
+        batch = [first]
+        deadline = loop.time() + self.interval
+        while len(batch) < self.max_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+    
+    async def _run(self):
+        while True:
+            first = await self._queue.get()
+            if first is None:
+                return
+            batch, stopping = await self._collect(first)
+            await self._slots.acquire()
+            flush = asyncio.create_task(self._flush(batch))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+            if stopping:
+                return
+    
+    async def _flush(self, batch: list):
+        try:
+            results = await run_db(
+                confirm_pending_batch,
+                [(pending_id, user_id) for pending_id, user_id, _ in batch],
+                self.lock_timeout
+            )
+        except Exception as e:
+            logger.warning(f"Ошибка при подтверждении пачки из {len(batch)} расходов, подтверждаю по одному: {str(e)}")
+            results = None
+        finally:
+            self._slots.release()
+        
+        if results is None:
+            await asyncio.gather(*(self._confirm_one(item) for item in batch))
+            return
+        for pending_id, user_id, future in batch:
+            if not future.done():
+                future.set_result(results.pop((pending_id, user_id), None))
+    
+    async def _confirm_one(self, item: tuple):
+        pending_id, user_id, future = item
+        try:
+            results = await run_db(confirm_pending_batch, [(pending_id, user_id)])
+        except Exception as e:
+            logger.error(f"Ошибка при подтверждении расхода {pending_id}: {str(e)}", exc_info=True)
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(results.get((pending_id, user_id)))
+    
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is None:
+            return
+        await self._queue.put(None)
+        await task
+        await asyncio.gather(*self._flushes)
+
+confirmation_batcher = ConfirmationBatcher(
+    CONFIRM_BATCH_INTERVAL, CONFIRM_BATCH_MAX_SIZE, CONFIRM_BATCH_CONCURRENCY, CONFIRM_BATCH_LOCK_TIMEOUT
+)
+
+async def confirm_pending(pending_id: int, user_id: int) -> Optional[tuple[list[dict], dict]]:
+    return await confirmation_batcher.confirm(pending_id, user_id)
+
+async def stop_confirmation_batcher():
+    await confirmation_batcher.stop()
+
+def discard_pending(pending_id: int, user_id: int) -> bool:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM pending_expenses WHERE id = %s AND user_id = %s", (pending_id, user_id))
+        deleted = cursor.rowcount > 0
+        conn.commit()
+    return deleted
+
+def purge_expired() -> int:
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM pending_expenses WHERE expires_at <= CURRENT_TIMESTAMP")
+            deleted = cursor.rowcount
+            conn.commit()
+    except Exception as e:
+        logger.warning(f"Ошибка при удалении устаревших неподтвержденных расходов: {str(e)}")
+        return 0
+    if deleted:
+        logger.info(f"Удалено устаревших неподтвержденных расходов: {deleted}")
+    return deleted
@@ -0,0 +1,164 @@
+from typing import Optional
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from exchange_rates import start_rate_refresher, start_rate_follower
+
+logger = logging.getLogger(__name__)
+
+WORKER_POLL_INTERVAL = 1.0
+WORKER_SHUTDOWN_TIMEOUT = 30.0
+UNBOUNDED_UPDATES = 1_000_000
+
+def update_user_id(update: object) -> Optional[int]:
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+def shard_for(user_id: Optional[int], shards: int) -> int:
+    return (user_id or 0) % shards
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(UNBOUNDED_UPDATES)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks = {}
+        self._waiting = {}
+
+    async def do_process_update(self, update, coroutine):
+        user_id = update_user_id(update)
+        if user_id is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        self._waiting[user_id] = self._waiting.get(user_id, 0) + 1
+        try:
+            async with lock, self._slots:
+                await coroutine
+        finally:
+            self._waiting[user_id] -= 1
+            if not self._waiting[user_id]:
+                del self._waiting[user_id]
+                del self._locks[user_id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+async def _serve_worker(index: int, updates, application, worker_init):
+    loop = asyncio.get_running_loop()
+    parent = multiprocessing.parent_process()
+
+    def next_update():
+        while True:
+            try:
+                return updates.get(timeout=WORKER_POLL_INTERVAL)
+            except queue.Empty:
+                if parent is not None and not parent.is_alive():
+                    return None
+
+    async with application:
+        await application.start()
+        await worker_init(application)
+        logger.info(f"Воркер {index} запущен")
+        while True:
+            data = await loop.run_in_executor(None, next_update)
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        logger.info(f"Воркер {index} останавливается")
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+    await application.post_shutdown(application)
+
+def _run_worker(index: int, updates, build_application, worker_init):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    start_rate_follower()
+    application = build_application(with_updater=False)
+    asyncio.run(_serve_worker(index, updates, application, worker_init))
+
+async def _run_ingress(workers: int, build_application, ingress_init, worker_init,
+                       webhook_options: Optional[dict], allowed_updates: list):
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue() for _ in range(workers)]
+
+    def start_worker(index: int):
+        process = context.Process(
+            target=_run_worker,
+            args=(index, queues[index], build_application, worker_init),
+            name=f"bot-worker-{index}"
+        )
+        process.start()
+        return process
+
+    start_rate_refresher()
+    processes = [start_worker(index) for index in range(workers)]
+
+    application = build_application()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    def forward(update):
+        if isinstance(update, Update):
+            queues[shard_for(update_user_id(update), workers)].put(update.to_dict())
+
+    async def forward_updates():
+        while True:
+            forward(await application.update_queue.get())
+
+    await application.initialize()
+    try:
+        await ingress_init(application)
+        if webhook_options:
+            await application.updater.start_webhook(**webhook_options)
+        else:
+            await application.updater.start_polling(allowed_updates=allowed_updates)
+        logger.info(f"Входящие обновления распределяются между {workers} воркерами")
+
+        forwarder = asyncio.create_task(forward_updates())
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=WORKER_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            for index, process in enumerate(processes):
+                if not process.is_alive() and not stop.is_set():
+                    logger.error(f"Воркер {index} завершился с кодом {process.exitcode}, перезапуск")
+                    processes[index] = start_worker(index)
+
+        await application.updater.stop()
+        forwarder.cancel()
+        while not application.update_queue.empty():
+            forward(application.update_queue.get_nowait())
+    finally:
+        for updates in queues:
+            updates.put(None)
+        for index, process in enumerate(processes):
+            process.join(WORKER_SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                logger.warning(f"Воркер {index} не завершился за {WORKER_SHUTDOWN_TIMEOUT} с, принудительная остановка")
+                process.terminate()
+        await application.shutdown()
+        await application.post_shutdown(application)
+
+def run_sharded(workers: int, build_application, ingress_init, worker_init,
+                webhook_options: Optional[dict] = None, allowed_updates: Optional[list] = None):
+    logger.info(f"Запуск {workers} воркеров")
+    asyncio.run(_run_ingress(workers, build_application, ingress_init, worker_init, webhook_options, allowed_updates))
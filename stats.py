@@ -0,0 +1,60 @@
+from typing import Optional
+import asyncio
+import logging
+
+from config import STATS_LOG_INTERVAL
+from executors import run_db
+from model_cache import get_cache_stats
+from db import get_pool_stats
+from image_preprocessing import get_preprocessing_stats
+from charts import get_chart_stats
+from jobs import get_job_stats
+
+logger = logging.getLogger(__name__)
+
+def collect_stats() -> dict:
+    stats = {
+        'db_pool': get_pool_stats(),
+        'model_cache': get_cache_stats(),
+        'images': get_preprocessing_stats(),
+        'charts': get_chart_stats(),
+    }
+    try:
+        stats['jobs'] = get_job_stats()
+    except Exception as e:
+        logger.warning(f"Не удалось получить состояние очереди задач: {str(e)}")
+    return stats
+
+class StatsLogger:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is not None or self.interval <= 0:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                stats = await run_db(collect_stats)
+                logger.info(f"Статистика: {stats}")
+            except Exception as e:
+                logger.error(f"Ошибка при сборе статистики: {str(e)}", exc_info=True)
+
+stats_logger = StatsLogger(STATS_LOG_INTERVAL)
+
+def start_stats_logger():
+    stats_logger.start()
+
+async def stop_stats_logger():
+    await stats_logger.stop()
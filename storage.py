@@ -1,55 +1,23 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from datetime import date, datetime
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from psycopg2.extras import execute_values
 from typing import Optional
 import logging
-import requests
+import threading
+import time
 import os
 
-from config import DATABASE_URL
+from config import USER_SETTINGS_CACHE_TTL, USER_SETTINGS_CACHE_SIZE
+from db import get_connection
+from exchange_rates import get_exchange_rates
+from migrations import run_migrations
 
 logger = logging.getLogger(__name__)
 
-_exchange_rates = None
+CONVERTIBLE_CURRENCIES = ('ARS', 'USD', 'RUB', 'EUR')
 
-def get_exchange_rates():
-    global _exchange_rates
-    if _exchange_rates is not None:
-        return _exchange_rates
-    
-    logger.info("Запрос актуальных курсов валют")
-    try:
-        response = requests.get("https://api.exchangerate-api.com/v4/latest/USD", timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            _exchange_rates = {
-                'USD': 1.0,
-                'ARS': data['rates']['ARS'],
-                'RUB': data['rates']['RUB'],
-                'EUR': data['rates']['EUR']
-            }
-            logger.info(f"Курсы валют получены: {_exchange_rates}")
-            return _exchange_rates
-        else:
-            logger.error(f"Ошибка получения курсов: код {response.status_code}")
-            _exchange_rates = {
-                'USD': 1.0,
-                'ARS': 900.0,
-                'RUB': 90.0,
-                'EUR': 1.1
-            }
-            logger.info(f"Используются резервные курсы: {_exchange_rates}")
-            return _exchange_rates
-    except Exception as e:
-        logger.error(f"Ошибка при получении курсов валют: {str(e)}", exc_info=True)
-        _exchange_rates = {
-            'USD': 1.0,
-            'ARS': 900.0,
-            'RUB': 90.0,
-            'EUR': 1.1
-        }
-        logger.info(f"Используются резервные курсы: {_exchange_rates}")
-        return _exchange_rates
+_settings_cache = OrderedDict()
+_settings_cache_lock = threading.Lock()
 
 def convert_to_ars(amount: float, currency: str) -> float:
     if currency == 'ARS':
@@ -67,198 +35,171 @@ def convert_to_ars(amount: float, currency: str) -> float:
         usd_amount = amount / rates[currency]
         return usd_amount * rates['ARS']
 
-def convert_currency(amount: float, from_currency: str, user_id: int, to_currency: str = None) -> float:
-    settings = get_user_settings(user_id)
+class ConversionContext:
+    def __init__(self, settings: dict, rates: dict):
+        self.display_currency = settings['display_currency']
+        self.usd_to_ars_rate = settings['usd_to_ars_rate']
+        self.rub_to_ars_rate = settings['rub_to_ars_rate']
+        self.rates = rates
     
-    if to_currency is None:
-        to_currency = settings['display_currency']
-    
-    if from_currency == to_currency:
-        return amount
+    def fixed_ars_rate(self, currency: str) -> Optional[float]:
+        if currency == 'ARS':
+            return 1.0
+        if currency == 'USD':
+            return self.usd_to_ars_rate
+        if currency == 'RUB':
+            return self.rub_to_ars_rate
+        return None
     
-    ars_amount = None
+    def ars_rate(self, currency: str) -> float:
+        if currency not in CONVERTIBLE_CURRENCIES or currency not in self.rates:
+            logger.warning(f"Неизвестная валюта {currency}, используется ARS напрямую")
+            return 1.0
+        return self.fixed_ars_rate(currency) or self.rates['ARS'] / self.rates[currency]
     
-    if from_currency == 'ARS':
-        ars_amount = amount
-    elif from_currency == 'USD':
-        if settings['usd_to_ars_rate']:
-            ars_amount = amount * settings['usd_to_ars_rate']
-        else:
-            rates = get_exchange_rates()
-            ars_amount = amount * rates['ARS']
-    elif from_currency == 'RUB':
-        if settings['rub_to_ars_rate']:
-            ars_amount = amount * settings['rub_to_ars_rate']
-        else:
-            rates = get_exchange_rates()
-            ars_amount = amount * (rates['ARS'] / rates['RUB'])
-    else:
-        logger.warning(f"Неизвестная валюта {from_currency}, используется ARS напрямую")
-        ars_amount = amount
-    
-    if to_currency == 'ARS':
-        return ars_amount
-    elif to_currency == 'USD':
-        if settings['usd_to_ars_rate']:
-            return ars_amount / settings['usd_to_ars_rate']
-        else:
-            rates = get_exchange_rates()
-            return ars_amount / rates['ARS']
-    elif to_currency == 'RUB':
-        if settings['rub_to_ars_rate']:
-            return ars_amount / settings['rub_to_ars_rate']
-        else:
-            rates = get_exchange_rates()
-            return ars_amount * (rates['RUB'] / rates['ARS'])
-    
-    return ars_amount
+    def convert(self, amount: float, from_currency: str, to_currency: str = None) -> float:
+        if to_currency is None:
+            to_currency = self.display_currency
+        
+        if from_currency == to_currency:
+            return amount
+        
+        return amount * self.ars_rate(from_currency) / self.ars_rate(to_currency)
 
-def get_connection():
-    return psycopg2.connect(DATABASE_URL)
+def get_conversion_context(user_id: int, cached: bool = True) -> ConversionContext:
+    settings = get_user_settings(user_id) if cached else _load_user_settings(user_id)
+    return ConversionContext(settings, get_exchange_rates())
 
-def init_user_settings_table():
-    logger.info("Инициализация таблицы настроек пользователей")
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_settings (
-            user_id INTEGER PRIMARY KEY,
-            display_currency TEXT DEFAULT 'ARS',
-            usd_to_ars_rate REAL DEFAULT NULL,
-            rub_to_ars_rate REAL DEFAULT NULL
-        )
-    """)
-    conn.commit()
-    conn.close()
-    logger.info("Таблица настроек пользователей инициализирована")
+def convert_currency(amount: float, from_currency: str, user_id: int, to_currency: str = None) -> float:
+    return get_conversion_context(user_id).convert(amount, from_currency, to_currency)
 
 def init_db():
     logger.info("Инициализация базы данных")
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS expenses (
-            id SERIAL PRIMARY KEY,
-            date DATE NOT NULL,
-            amount REAL NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    conn.commit()
-    
-    cursor.execute("""
-        SELECT column_name 
-        FROM information_schema.columns 
-        WHERE table_name='expenses'
-    """)
-    columns = [row[0] for row in cursor.fetchall()]
-    
-    if 'currency' not in columns:
-        logger.info("Добавление поля currency в таблицу expenses")
-        cursor.execute("ALTER TABLE expenses ADD COLUMN currency TEXT DEFAULT 'RUB'")
-        conn.commit()
-    
-    if 'category' not in columns:
-        logger.info("Добавление поля category в таблицу expenses")
-        cursor.execute("ALTER TABLE expenses ADD COLUMN category TEXT DEFAULT 'другие'")
-        conn.commit()
-    
-    if 'user_id' not in columns:
-        logger.info("Добавление поля user_id в таблицу expenses")
-        cursor.execute("ALTER TABLE expenses ADD COLUMN user_id INTEGER NOT NULL DEFAULT 0")
-        conn.commit()
-    
-    conn.close()
-    
-    init_user_settings_table()
+    run_migrations()
     logger.info("База данных инициализирована успешно")
 
-def add_expense(amount: float, currency: str = 'RUB', category: str = 'другие', user_id: int = 0, expense_date: Optional[date] = None):
+def expense_rows(expenses: list[dict], user_id: int, expense_date: Optional[date] = None) -> list[tuple]:
     if expense_date is None:
         expense_date = date.today()
-    
-    logger.info(f"Добавление расхода: {amount:.2f} {currency} ({category}) для пользователя {user_id} на дату {expense_date}")
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO expenses (date, amount, currency, category, user_id)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (expense_date.isoformat(), amount, currency, category, user_id))
-        conn.commit()
-        conn.close()
-        logger.info(f"Расход {amount:.2f} {currency} ({category}) для пользователя {user_id} успешно сохранен")
-    except Exception as e:
-        logger.error(f"Ошибка при сохранении расхода: {str(e)}", exc_info=True)
-        raise
+    return [
+        (expense_date.isoformat(), expense['amount'], expense['currency'], expense['category'], user_id)
+        for expense in expenses
+    ]
+
+def insert_expense_rows(cursor, rows: list[tuple]):
+    execute_values(cursor, """
+        INSERT INTO expenses (date, amount, currency, category, user_id)
+        VALUES %s
+    """, rows)
 
-def get_expenses_by_date(expense_date: date, user_id: int) -> dict:
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT amount, currency, category FROM expenses
-        WHERE date = %s AND user_id = %s
-    """, (expense_date.isoformat(), user_id))
-    results = cursor.fetchall()
-    conn.close()
+def _query_period_totals(periods: list[tuple[date, date]], user_id: int, group_column: str, cursor=None) -> list[tuple]:
+    ctx = get_conversion_context(user_id)
+    rate_rows = []
+    rate_params = []
+    for currency in CONVERTIBLE_CURRENCIES:
+        rate_rows.append("(%s, %s::float8, %s::float8)")
+        rate_params.extend([currency, ctx.fixed_ars_rate(currency), ctx.rates.get(currency)])
     
-    totals = {}
-    for amount, currency, category in results:
-        if currency is None:
-            currency = 'RUB'
-        if category is None:
-            category = 'другие'
-        
-        converted_amount = convert_currency(amount, currency, user_id)
-        
-        if category not in totals:
-            totals[category] = 0.0
-        totals[category] += converted_amount
+    period_rows = []
+    period_params = []
+    for index, (start_date, end_date) in enumerate(periods):
+        period_rows.append("(%s, %s::date, %s::date)")
+        period_params.extend([index, start_date.isoformat(), end_date.isoformat()])
+    
+    query = f"""
+        WITH ctx (currency, fixed_ars, current_per_usd) AS (
+            VALUES {', '.join(rate_rows)}
+        ),
+        periods (idx, start_date, end_date) AS (
+            VALUES {', '.join(period_rows)}
+        ),
+        daily AS (
+            SELECT periods.idx, dt.category, dt.currency, dt.date, dt.sum AS total
+            FROM periods
+            JOIN daily_totals dt
+              ON dt.user_id = %s AND dt.date >= periods.start_date AND dt.date < periods.end_date
+        ),
+        day_rates AS (
+            SELECT d.date, ctx.currency,
+                   COALESCE(
+                       ctx.fixed_ars,
+                       COALESCE(ars.per_usd, (SELECT current_per_usd FROM ctx WHERE currency = 'ARS'))
+                           / COALESCE(cur.per_usd, ctx.current_per_usd)
+                   ) AS ars_per_unit
+            FROM (SELECT DISTINCT date FROM daily) d
+            CROSS JOIN ctx
+            LEFT JOIN LATERAL (
+                SELECT per_usd FROM exchange_rates_history
+                WHERE currency = 'ARS' AND rate_date <= d.date
+                ORDER BY rate_date DESC LIMIT 1
+            ) ars ON TRUE
+            LEFT JOIN LATERAL (
+                SELECT per_usd FROM exchange_rates_history
+                WHERE currency = ctx.currency AND rate_date <= d.date
+                ORDER BY rate_date DESC LIMIT 1
+            ) cur ON TRUE
+        )
+        SELECT daily.idx, daily.{group_column},
+               SUM(daily.total * COALESCE(f.ars_per_unit, 1) / COALESCE(t.ars_per_unit, 1))
+        FROM daily
+        LEFT JOIN day_rates f ON f.date = daily.date AND f.currency = daily.currency
+        LEFT JOIN day_rates t ON t.date = daily.date AND t.currency = %s
+        GROUP BY daily.idx, daily.{group_column}
+        ORDER BY daily.idx, daily.{group_column}
+    """
+    params = rate_params + period_params + [user_id, ctx.display_currency]
+    
+    if cursor is None:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            return cursor.fetchall()
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
+def get_expenses_by_periods(periods: list[tuple[date, date]], user_id: int, cursor=None) -> list[dict]:
+    totals = [{} for _ in periods]
+    for index, category, total in _query_period_totals(periods, user_id, 'category', cursor):
+        totals[index][category] = total
     return totals
 
+def get_daily_series(start_date: date, end_date: date, user_id: int) -> list[tuple[date, float]]:
+    return [(day, total) for _, day, total in _query_period_totals([(start_date, end_date)], user_id, 'date')]
+
+def get_expenses_by_range(start_date: date, end_date: date, user_id: int, cursor=None) -> dict:
+    return get_expenses_by_periods([(start_date, end_date)], user_id, cursor)[0]
+
+def get_expenses_by_date(expense_date: date, user_id: int, cursor=None) -> dict:
+    return get_expenses_by_range(expense_date, expense_date + timedelta(days=1), user_id, cursor)
+
+def month_bounds(year: int, month: int) -> tuple[date, date]:
+    first_day = date(year, month, 1)
+    if month == 12:
+        next_month = date(year + 1, 1, 1)
+    else:
+        next_month = date(year, month + 1, 1)
+    return first_day, next_month
+
 def get_monthly_expenses(year: int, month: int, user_id: int) -> dict:
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT amount, currency, category FROM expenses
-        WHERE EXTRACT(YEAR FROM date) = %s AND EXTRACT(MONTH FROM date) = %s AND user_id = %s
-    """, (year, month, user_id))
-    results = cursor.fetchall()
-    conn.close()
-    
-    totals = {}
-    for amount, currency, category in results:
-        if currency is None:
-            currency = 'RUB'
-        if category is None:
-            category = 'другие'
-        
-        converted_amount = convert_currency(amount, currency, user_id)
-        
-        if category not in totals:
-            totals[category] = 0.0
-        totals[category] += converted_amount
-    return totals
+    return get_expenses_by_range(*month_bounds(year, month), user_id)
 
-def get_today_total(user_id: int) -> dict:
+def get_today_total(user_id: int, cursor=None) -> dict:
     today = date.today()
-    return get_expenses_by_date(today, user_id)
+    return get_expenses_by_date(today, user_id, cursor)
 
 def get_month_total(user_id: int) -> dict:
     today = date.today()
     return get_monthly_expenses(today.year, today.month, user_id)
 
-def get_user_settings(user_id: int) -> dict:
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT display_currency, usd_to_ars_rate, rub_to_ars_rate
-        FROM user_settings
-        WHERE user_id = %s
-    """, (user_id,))
-    result = cursor.fetchone()
-    conn.close()
+def _load_user_settings(user_id: int) -> dict:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT display_currency, usd_to_ars_rate, rub_to_ars_rate
+            FROM user_settings
+            WHERE user_id = %s
+        """, (user_id,))
+        result = cursor.fetchone()
     
     if result:
         return {
@@ -273,40 +214,55 @@ def get_user_settings(user_id: int) -> dict:
             'rub_to_ars_rate': None
         }
 
+def get_user_settings(user_id: int) -> dict:
+    now = time.monotonic()
+    with _settings_cache_lock:
+        cached = _settings_cache.get(user_id)
+        if cached is not None and cached[0] > now:
+            _settings_cache.move_to_end(user_id)
+            return dict(cached[1])
+    
+    settings = _load_user_settings(user_id)
+    
+    with _settings_cache_lock:
+        _settings_cache[user_id] = (now + USER_SETTINGS_CACHE_TTL, settings)
+        _settings_cache.move_to_end(user_id)
+        while len(_settings_cache) > USER_SETTINGS_CACHE_SIZE:
+            _settings_cache.popitem(last=False)
+    return dict(settings)
+
+def invalidate_user_settings(user_id: int):
+    with _settings_cache_lock:
+        _settings_cache.pop(user_id, None)
+
 def set_display_currency(user_id: int, currency: str):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO user_settings (user_id, display_currency)
-        VALUES (%s, %s)
-        ON CONFLICT (user_id) DO UPDATE SET display_currency = %s
-    """, (user_id, currency, currency))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO user_settings (user_id, display_currency)
+            VALUES (%s, %s)
+            ON CONFLICT (user_id) DO UPDATE SET display_currency = %s
+        """, (user_id, currency, currency))
+        conn.commit()
+    invalidate_user_settings(user_id)
     logger.info(f"Установлена валюта отображения для пользователя {user_id}: {currency}")
 
 def set_exchange_rate(user_id: int, from_currency: str, to_currency: str, rate: float):
-    conn = get_connection()
-    cursor = conn.cursor()
-    
     if from_currency == 'USD' and to_currency == 'ARS':
-        cursor.execute("""
-            INSERT INTO user_settings (user_id, usd_to_ars_rate)
-            VALUES (%s, %s)
-            ON CONFLICT (user_id) DO UPDATE SET usd_to_ars_rate = %s
-        """, (user_id, rate, rate))
+        column = 'usd_to_ars_rate'
     elif from_currency == 'RUB' and to_currency == 'ARS':
-        cursor.execute("""
-            INSERT INTO user_settings (user_id, rub_to_ars_rate)
-            VALUES (%s, %s)
-            ON CONFLICT (user_id) DO UPDATE SET rub_to_ars_rate = %s
-        """, (user_id, rate, rate))
+        column = 'rub_to_ars_rate'
     else:
         logger.warning(f"Неподдерживаемый курс: {from_currency} -> {to_currency}")
-        conn.close()
         return
     
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            INSERT INTO user_settings (user_id, {column})
+            VALUES (%s, %s)
+            ON CONFLICT (user_id) DO UPDATE SET {column} = %s
+        """, (user_id, rate, rate))
+        conn.commit()
+    invalidate_user_settings(user_id)
     logger.info(f"Установлен курс для пользователя {user_id}: 1 {from_currency} = {rate} {to_currency}")
-
@@ -0,0 +1,75 @@
+import pytest
+
+from expense_parser import find_currency, parse_number, parse_expense_locally, parse_expenses_locally
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("1500", 1500.0),
+    ("1 500", 1500.0),
+    ("1.500", 1500.0),
+    ("1,500", 1500.0),
+    ("1.500.000", 1500000.0),
+    ("1,5", 1.5),
+    ("12.50", 12.5),
+    ("0.500", 0.5),
+    ("1.234,56", 1234.56),
+    ("1,234.56", 1234.56),
+    ("1 500,50", 1500.5),
+])
+def test_parse_number(raw, expected):
+    assert parse_number(raw) == expected
+
+
+@pytest.mark.parametrize("text, amount, currency, category", [
+    ("кофе 1500", 1500.0, 'ARS', 'еда'),
+    ("такси 20 usd", 20.0, 'USD', 'транспорт'),
+    ("продукты 15 тысяч", 15000.0, 'ARS', 'еда'),
+    ("такси 2к", 2000.0, 'ARS', 'транспорт'),
+    ("такси 2 k", 2000.0, 'ARS', 'транспорт'),
+    ("кофе 500 к обеду", 500.0, 'ARS', 'еда'),
+    ("пиццу 1.500 песо", 1500.0, 'ARS', 'еда'),
+    ("аптека 20 евро", 20.0, 'EUR', 'здоровье'),
+])
+def test_parse_expense_locally(text, amount, currency, category):
+    expense = parse_expense_locally(text)
+    assert (expense.amount, expense.currency, expense.category) == (amount, currency, category)
+
+
+@pytest.mark.parametrize("text", [
+    "клубника 3000",
+    "сушилка 500",
+    "кафель 2000",
+    "светильник 4000",
+    "рыбалка 100",
+    "кофе и такси 1500",
+    "кофе 100 и такси 200",
+    "купил что-то",
+])
+def test_parse_expense_locally_leaves_unknown_to_model(text):
+    assert parse_expense_locally(text) is None
+
+
+def test_parse_expenses_locally_splits_items():
+    expenses = parse_expenses_locally("кофе 500 к обеду, такси 2к\nаптека 20 usd")
+    assert [(e.amount, e.currency, e.category) for e in expenses] == [
+        (500.0, 'ARS', 'еда'),
+        (2000.0, 'ARS', 'транспорт'),
+        (20.0, 'USD', 'здоровье'),
+    ]
+
+
+def test_parse_expenses_locally_falls_back_when_any_item_is_unknown():
+    assert parse_expenses_locally("кофе 500; клубника 3000") is None
+    assert parse_expenses_locally("  ") is None
+
+
+@pytest.mark.parametrize("caption, currency", [
+    ("usd", 'USD'),
+    ("выписка в долларах", None),
+    ("выписка, валюта песо", 'ARS'),
+    ("EUR", 'EUR'),
+    ("выписка за май", None),
+    ("usd или eur", None),
+])
+def test_find_currency(caption, currency):
+    assert find_currency(caption) == currency
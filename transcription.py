@@ -0,0 +1,135 @@
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import importlib.util
+import io
+import logging
+import multiprocessing
+
+from config import (
+    TRANSCRIPTION_BACKEND,
+    LOCAL_STT_MODEL,
+    LOCAL_STT_COMPUTE_TYPE,
+    LOCAL_STT_LANGUAGE,
+    LOCAL_STT_WORKERS,
+    LOCAL_STT_MAX_DURATION,
+)
+from model_cache import cached_call, make_key, digest_stream
+from openai_client import transcribe_audio
+
+logger = logging.getLogger(__name__)
+
+_worker_model = None
+
+def _init_local_worker(model_name: str, compute_type: str):
+    global _worker_model
+    from faster_whisper import WhisperModel
+    _worker_model = WhisperModel(model_name, device="cpu", compute_type=compute_type)
+
+def _transcribe_in_worker(data: bytes, language: str) -> str:
+    segments, _ = _worker_model.transcribe(io.BytesIO(data), language=language or None, beam_size=1)
+    return ' '.join(segment.text.strip() for segment in segments).strip()
+
+class TranscriptionBackend(ABC):
+    name = 'base'
+    
+    @abstractmethod
+    def transcribe(self, audio_file, filename: str = "voice.ogg", duration: Optional[float] = None) -> str:
+        pass
+    
+    def close(self):
+        pass
+
+class WhisperApiBackend(TranscriptionBackend):
+    name = 'api'
+    
+    def transcribe(self, audio_file, filename: str = "voice.ogg", duration: Optional[float] = None) -> str:
+        return transcribe_audio(audio_file, filename)
+
+class LocalWhisperBackend(TranscriptionBackend):
+    name = 'local'
+    
+    def __init__(self, model_name: str, compute_type: str, language: str, workers: int):
+        self.model_name = model_name
+        self.language = language
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_local_worker,
+            initargs=(model_name, compute_type)
+        )
+    
+    @staticmethod
+    def is_available() -> bool:
+        return importlib.util.find_spec('faster_whisper') is not None
+    
+    def transcribe(self, audio_file, filename: str = "voice.ogg", duration: Optional[float] = None) -> str:
+        key = make_key('transcription', f"local-{self.model_name}", 1, digest_stream(audio_file))
+        
+        def request():
+            logger.info(f"Локальная транскрипция аудио моделью {self.model_name}")
+            audio_file.seek(0)
+            text = self._executor.submit(_transcribe_in_worker, audio_file.read(), self.language).result()
+            logger.info(f"Локальная транскрипция получена: {text[:100]}")
+            return text
+        
+        return cached_call('transcription', key, request)
+    
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+class DurationRoutingBackend(TranscriptionBackend):
+    name = 'auto'
+    
+    def __init__(self, local: TranscriptionBackend, remote: TranscriptionBackend, max_local_duration: float):
+        self.local = local
+        self.remote = remote
+        self.max_local_duration = max_local_duration
+    
+    def transcribe(self, audio_file, filename: str = "voice.ogg", duration: Optional[float] = None) -> str:
+        if duration is not None and duration <= self.max_local_duration:
+            try:
+                return self.local.transcribe(audio_file, filename, duration)
+            except Exception as e:
+                logger.error(f"Ошибка локальной транскрипции, используется Whisper API: {str(e)}", exc_info=True)
+        return self.remote.transcribe(audio_file, filename, duration)
+    
+    def close(self):
+        self.local.close()
+        self.remote.close()
+
+TRANSCRIPTION_BACKENDS = ('api', 'local', 'auto')
+
+def create_backend(name: str = TRANSCRIPTION_BACKEND) -> TranscriptionBackend:
+    if name not in TRANSCRIPTION_BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд транскрипции: {name}, ожидается один из {', '.join(TRANSCRIPTION_BACKENDS)}")
+    
+    if name in ('local', 'auto') and not LocalWhisperBackend.is_available():
+        logger.warning("Пакет faster-whisper не установлен, для транскрипции используется Whisper API")
+        name = 'api'
+    
+    if name == 'api':
+        return WhisperApiBackend()
+    
+    local = LocalWhisperBackend(LOCAL_STT_MODEL, LOCAL_STT_COMPUTE_TYPE, LOCAL_STT_LANGUAGE, LOCAL_STT_WORKERS)
+    if name == 'local':
+        return local
+    return DurationRoutingBackend(local, WhisperApiBackend(), LOCAL_STT_MAX_DURATION)
+
+_backend: Optional[TranscriptionBackend] = None
+
+def get_backend() -> TranscriptionBackend:
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+        logger.info(f"Бэкенд транскрипции: {_backend.name}")
+    return _backend
+
+def transcribe(audio_file, duration: Optional[float] = None, filename: str = "voice.ogg") -> str:
+    return get_backend().transcribe(audio_file, filename, duration)
+
+def close_backend():
+    global _backend
+    if _backend is not None:
+        _backend.close()
+        _backend = None